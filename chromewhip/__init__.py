@@ -1,4 +1,5 @@
 import asyncio.subprocess
+import functools
 import logging
 import logging.config
 import platform
@@ -11,8 +12,13 @@ from aiohttp import web
 import yaml
 
 from chromewhip.chrome import Chrome
-from chromewhip.middleware import error_middleware
+from chromewhip.filters import load_filters
+from chromewhip.middleware import error_middleware, metrics_middleware
+from chromewhip.pool import TabPool
+from chromewhip.profiles import ProfileRegistry
 from chromewhip.routes import setup_routes
+from chromewhip.transport import launch_with_pipe
+from chromewhip.watchdog import Watchdog
 
 
 log = logging.getLogger(__name__)
@@ -20,9 +26,27 @@ log = logging.getLogger(__name__)
 HOST = '127.0.0.1'
 PORT = 9222
 NUM_TABS = 4
+# pooled tabs are replaced after any of these, as sites leak memory into long lived renderers
+TAB_MAX_RENDERS = 200
+TAB_MAX_AGE_S = 60 * 30
+TAB_MAX_HEAP_BYTES = 2 ** 28
 DISPLAY = ':99'
+FILTERS_CACHE_DIRNAME = '.compiled'
+# large enough for a `/render.batch` of 10,000 URLs
+MAX_REQUEST_BODY_BYTES = 2 ** 24
+
+async def on_startup(app):
+    if isinstance(app['js-profiles'], ProfileRegistry):
+        app['js-profiles-watcher'] = asyncio.ensure_future(app['js-profiles'].watch())
+    app['watchdog'] = asyncio.ensure_future(Watchdog(app).run())
+
 
 async def on_shutdown(app):
+    for key in ('js-profiles-watcher', 'watchdog'):
+        task = app.get(key)
+        if task:
+            task.cancel()
+
     c = app['chrome-driver']
     if c.is_connected:
         for tab in c.tabs:
@@ -44,25 +68,64 @@ async def on_shutdown(app):
 Settings = namedtuple('Settings', [
     'chrome_fp',
     'chrome_flags',
-    'should_run_xfvb'
+    'should_run_xfvb',
+    'use_pipe'
 ])
 
-def get_settings():
+HEADLESS_FLAGS = [
+    '--headless',
+    '--disable-gpu',
+]
+# switch off work nobody benefits from when serving renders, like throttling the timers of background tabs, which
+# every pooled tab but one is
+PERFORMANCE_FLAGS = [
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+    '--disable-ipc-flooding-protection',
+    '--disable-hang-monitor',
+    '--disable-breakpad',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-extensions',
+    '--disable-sync',
+    '--disable-features=TranslateUI',
+    '--metrics-recording-only',
+    '--mute-audio',
+    '--no-default-browser-check',
+    '--password-store=basic',
+    '--use-mock-keychain',
+]
+
+
+def get_settings(headless: bool = True, use_pipe: bool = False):
+    """
+    :param headless: run Chrome without any display, otherwise it is run headful under Xvfb on Linux, e.g. to watch
+    it over VNC
+    :param use_pipe: talk to Chrome over `--remote-debugging-pipe` rather than websockets on `PORT`
+    """
     chrome_flags = [
         '--window-size=1920,1080',
         '--enable-logging',
         '--hide-scrollbars',
         '--no-first-run',
-        '--remote-debugging-address=%s' % HOST,
-        '--remote-debugging-port=%s' % PORT,
         '--user-data-dir=/tmp',
-        'about:blank'  # TODO: multiple tabs
     ]
+    if not use_pipe:
+        chrome_flags[4:4] = [
+            '--remote-debugging-address=%s' % HOST,
+            '--remote-debugging-port=%s' % PORT,
+        ]
+    chrome_flags += PERFORMANCE_FLAGS
+    if headless:
+        chrome_flags += HEADLESS_FLAGS
+    chrome_flags.append('about:blank')  # TODO: multiple tabs
     os_type = platform.system()
     if os_type == 'Linux':
         chrome_flags.insert(3, '--no-sandbox')
         chrome_fp = '/opt/google/chrome/chrome'
-        should_run_xfvb = True
+        should_run_xfvb = not headless
     elif os_type == 'Darwin':
         chrome_fp = '/Applications/Google Chrome Canary.app/Contents/MacOS/Google Chrome Canary'
         should_run_xfvb = False
@@ -71,17 +134,30 @@ def get_settings():
     return Settings(
         chrome_fp,
         chrome_flags,
-        should_run_xfvb
+        should_run_xfvb,
+        use_pipe
     )
 
 
-def setup_chrome(settings: Settings, env: dict = None, loop: asyncio.AbstractEventLoop = None):
+def setup_chrome(settings: Settings, env: dict = None, loop: asyncio.AbstractEventLoop = None,
+                 driver: Chrome = None):
+    """
+    :param driver: switched over to the pipe of the new process, when `settings.use_pipe`
+    """
     # TODO: manage process lifecycle in coro
     args = [settings.chrome_fp] + settings.chrome_flags
+    if settings.use_pipe:
+        return _launch_chrome_with_pipe(args, driver, env, loop)
     chrome = asyncio.subprocess.create_subprocess_exec(*args, env=env, loop=loop)
     return chrome
 
 
+async def _launch_chrome_with_pipe(args, driver: Chrome, env: dict, loop: asyncio.AbstractEventLoop):
+    process, connection = await launch_with_pipe(args, env=env, loop=loop)
+    driver.use_pipe(connection)
+    return process
+
+
 def setup_xvfb(settings: Settings, env: dict = None, loop: asyncio.AbstractEventLoop = None):
     # TODO: manage process lifecycle in coro
     if not settings.should_run_xfvb:
@@ -102,27 +178,31 @@ def setup_xvfb(settings: Settings, env: dict = None, loop: asyncio.AbstractEvent
     return xvfb
 
 
-def setup_app(loop=None, js_profiles_path=None):
-    app = web.Application(loop=loop, middlewares=[error_middleware])
+def setup_app(loop=None, js_profiles_path=None, filters_path=None, incognito=False):
+    app = web.Application(loop=loop,
+                          middlewares=[error_middleware, metrics_middleware],
+                          client_max_size=MAX_REQUEST_BODY_BYTES)
 
     js_profiles = {}
 
     if js_profiles_path:
-        root, _, files, _ = next(os.fwalk(js_profiles_path))
-        js_files = filter(lambda f: os.path.splitext(f)[1] == '.js', files)
-        _, profile_name = os.path.split(root)
-        log.debug('adding profile "{}"'.format(profile_name))
-        js_profiles[profile_name] = ""
-        for f in js_files:
-            code = open(os.path.join(root, f)).read()
-            js_profiles[profile_name] += '{}\n'.format(code)
+        js_profiles = ProfileRegistry(js_profiles_path)
+        js_profiles.reload()
+
+    filters = {}
+    if filters_path:
+        filters = load_filters(filters_path, cache_dir=os.path.join(filters_path, FILTERS_CACHE_DIRNAME))
 
+    app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
 
     c = Chrome(host=HOST, port=PORT)
 
     app['chrome-driver'] = c
+    app['tab-pool'] = TabPool(c, size=NUM_TABS, max_renders=TAB_MAX_RENDERS, max_age_s=TAB_MAX_AGE_S,
+                              max_heap_bytes=TAB_MAX_HEAP_BYTES, incognito=incognito)
     app['js-profiles'] = js_profiles
+    app['filters'] = filters
 
     setup_routes(app)
 
@@ -138,11 +218,23 @@ if __name__ == '__main__':
     logging.config.dictConfig(config['logging'])
     parser = argparse.ArgumentParser()
     parser.add_argument('--js-profiles-path',
-                        help="path to a folder with javascript profiles")
+                        help="path to a folder with a subfolder of javascript files per profile, reloaded on changes")
+    parser.add_argument('--filters-path',
+                        help="path to a folder with adblock style filter lists, one `<name>.txt` per filter")
+    parser.add_argument('--incognito', action='store_true',
+                        help="render each request in a fresh incognito browser context, sharing no cookies or cache")
+    parser.add_argument('--headful', action='store_true',
+                        help="run Chrome with a display, under Xvfb on Linux, rather than headless")
+    parser.add_argument('--pipe', action='store_true',
+                        help="talk to Chrome over --remote-debugging-pipe rather than websockets")
     args = parser.parse_args(sys.argv[1:])
     kwargs = {}
     if args.js_profiles_path:
         kwargs['js_profiles_path'] = args.js_profiles_path
+    if args.filters_path:
+        kwargs['filters_path'] = args.filters_path
+    if args.incognito:
+        kwargs['incognito'] = True
 
     loop = asyncio.get_event_loop()
 
@@ -150,7 +242,7 @@ if __name__ == '__main__':
        'DISPLAY': DISPLAY
     }
 
-    settings = get_settings()
+    settings = get_settings(headless=not args.headful, use_pipe=args.pipe)
     app = setup_app(**kwargs, loop=loop)
 
     if settings.should_run_xfvb:
@@ -159,12 +251,14 @@ if __name__ == '__main__':
         log.debug('Started xvfb!')
         app['xvfb-process'] = xvfb_future
 
-    chrome = setup_chrome(settings, env=env, loop=loop)
+    chrome = setup_chrome(settings, env=env, loop=loop, driver=app['chrome-driver'])
     chrome_future = loop.run_until_complete(chrome)
     time.sleep(3)  # TODO: use event for continuing as opposed to sleep
 
     log.debug('Started Chrome!')
     app['chrome-process'] = chrome_future
+    # lets the watchdog respawn Chrome should it crash or hang
+    app['chrome-launcher'] = functools.partial(setup_chrome, settings, env=env, loop=loop, driver=app['chrome-driver'])
 
     # TODO: need indication from chrome process to start http server
     loop.run_until_complete(asyncio.sleep(3))
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import re
+
+from chromewhip import filters as filters_
+from chromewhip.chrome import ChromewhipException
+from chromewhip.protocol import fetch, page
+
+# https://chromedevtools.github.io/devtools-protocol/tot/Network#type-ResourceType
+RESOURCE_TYPES = {t.lower(): t for t in (
+    'Document', 'Stylesheet', 'Image', 'Media', 'Font', 'Script', 'TextTrack', 'XHR', 'Fetch', 'EventSource',
+    'WebSocket', 'Manifest', 'SignedExchange', 'Ping', 'CSPViolationReport', 'Other',
+)}
+BLOCKED_ERROR_REASON = 'BlockedByClient'
+
+log = logging.getLogger('chromewhip.blocking')
+
+
+def _url_pattern_regex(pattern: str) -> str:
+    # same wildcard semantics as Fetch's `urlPattern`, where `*` and `?` are the only special characters
+    return '(?:%s)\\Z' % re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.')
+
+
+class RequestBlocker:
+    """ Fails requests for unwanted resource types and URLs using the Fetch domain.
+
+    Only requests matching the blocking rules are paused by Chrome, and each paused request is answered by a per-tab
+    interception loop that never waits on one reply before handling the next pause. Filter lists can only be applied
+    by the loop, so with any `filters` every request is paused.
+    """
+    def __init__(self, resource_types: [str] = (), url_patterns: [str] = (),
+                 filters: [filters_.FilterEngine] = (), document_url: str = None):
+        self._resource_types = set(resource_types)
+        self._filters = list(filters)
+        self._document_url = document_url
+        self._main_frame_id = None
+        self._url_patterns = list(url_patterns)
+        self._url_regex = re.compile('|'.join(_url_pattern_regex(p) for p in url_patterns), re.DOTALL) \
+            if url_patterns else None
+        self._queue = asyncio.Queue()
+        self._loop_task = None
+        self._pending = set()
+        self.blocked = 0
+
+    @classmethod
+    def from_query(cls, query, filters: {str: filters_.FilterEngine} = None) -> 'RequestBlocker':
+        """
+        Build from the `images`, `block_types`, `block_urls` and `filters` query params, returning None if nothing
+        is blocked. As with splash, the `default` filter applies unless `filters` names others, or is `none`.
+
+        :raises ValueError: on unknown resource types or filter names
+        """
+        filters = filters or {}
+        resource_types = []
+        if query.get('images') == '0':
+            resource_types.append(RESOURCE_TYPES['image'])
+        for name in filter(None, query.get('block_types', '').split(',')):
+            try:
+                resource_types.append(RESOURCE_TYPES[name.strip().lower()])
+            except KeyError:
+                raise ValueError('unknown resource type "%s"' % name)
+        url_patterns = [p.strip() for p in query.get('block_urls', '').split(',') if p.strip()]
+
+        filter_names = query.get('filters')
+        if filter_names is None:
+            filter_names = [filters_.DEFAULT_FILTER_NAME] if filters_.DEFAULT_FILTER_NAME in filters else []
+        elif filter_names == filters_.NO_FILTERS:
+            filter_names = []
+        else:
+            filter_names = [n.strip() for n in filter_names.split(',') if n.strip()]
+        engines = []
+        for name in filter_names:
+            try:
+                engines.append(filters[name])
+            except KeyError:
+                raise ValueError('unknown filter "%s"' % name)
+
+        if not resource_types and not url_patterns and not engines:
+            return None
+        return cls(resource_types=resource_types, url_patterns=url_patterns, filters=engines,
+                   document_url=query.get('url'))
+
+    @property
+    def patterns(self) -> [fetch.RequestPattern]:
+        if self._filters:
+            return [fetch.RequestPattern(urlPattern='*', requestStage='Request')]
+        patterns = [fetch.RequestPattern(urlPattern='*', resourceType=t, requestStage='Request')
+                    for t in sorted(self._resource_types)]
+        patterns += [fetch.RequestPattern(urlPattern=p, requestStage='Request') for p in self._url_patterns]
+        return patterns
+
+    def should_block(self, event: fetch.RequestPausedEvent) -> bool:
+        if event.resourceType in self._resource_types:
+            return True
+        url = event.request.url
+        if self._url_regex and self._url_regex.match(url):
+            return True
+        if event.resourceType == RESOURCE_TYPES['document'] and event.frameId == self._main_frame_id:
+            # filter lists never block the page itself, whatever URL it ends up at after normalising or redirects
+            return False
+        return any(f.match(url, event.resourceType, self._document_url) for f in self._filters)
+
+    async def attach(self, tab):
+        res = await tab.send_command(page.Page.getFrameTree())
+        # the generated FrameTree leaves its frame as a dict
+        self._main_frame_id = res['ack']['result']['frameTree'].frame['id']
+        tab.add_event_listener(fetch.RequestPausedEvent, self._queue.put_nowait)
+        self._loop_task = asyncio.ensure_future(self._interception_loop(tab))
+        await tab.send_command(fetch.Fetch.enable(patterns=self.patterns))
+
+    async def detach(self, tab):
+        tab.remove_event_listener(fetch.RequestPausedEvent, self._queue.put_nowait)
+        try:
+            await tab.send_command(fetch.Fetch.disable())
+        finally:
+            self._loop_task.cancel()
+            if self._pending:
+                await asyncio.wait(self._pending)
+
+    async def _interception_loop(self, tab):
+        while True:
+            event = await self._queue.get()
+            if self.should_block(event):
+                self.blocked += 1
+                command = fetch.Fetch.failRequest(requestId=event.requestId, errorReason=BLOCKED_ERROR_REASON)
+            else:
+                command = fetch.Fetch.continueRequest(requestId=event.requestId)
+            task = asyncio.ensure_future(self._resolve(tab, command))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _resolve(self, tab, command):
+        try:
+            await tab.send_command(command)
+        except ChromewhipException as e:
+            # the request may have been cancelled by the page in the meantime
+            log.debug('Unable to resolve paused request: %s' % e)
@@ -1,21 +1,31 @@
 import asyncio
 import base64
-import json
+import functools
 import logging
+import warnings
+from collections import OrderedDict
 from typing import Optional
 
 import aiohttp
-import websockets
-import websockets.protocol
-import websockets.exceptions
 
-from chromewhip import helpers
+from chromewhip import helpers, metrics
 from chromewhip.base import SyncAdder
-from chromewhip.protocol import page, runtime, target, input, inspector, browser, accessibility
+from chromewhip.protocol import page, runtime, target, input, inspector, browser, accessibility, fetch, io, tracing
+from chromewhip.transport import PipeConnection, Transport, TransportClosed, WebSocketTransport
 
 TIMEOUT_S = 25
+# reconnects attempted by `send_command` when the connection closes under it
+MAX_SEND_RETRIES = 3
 MAX_PAYLOAD_SIZE_BYTES = 2 ** 23
 MAX_PAYLOAD_SIZE_MB = MAX_PAYLOAD_SIZE_BYTES / 1024 ** 2
+# bytes asked for per `IO.read`, which Chrome sends base64 encoded so well within MAX_PAYLOAD_SIZE_BYTES
+IO_READ_CHUNK_BYTES = 2 ** 20
+# chatty domains like Network emit an event per request, so only the most recent events are kept around
+MAX_STORED_EVENTS = 1000
+# a domain stays enabled this long after its last user is done, in case the next render needs it again
+DOMAIN_DISABLE_DELAY_S = 1
+# events with large payloads that are only ever handled by listeners, so aren't kept around for `send_command`
+UNSTORED_EVENTS = {page.ScreencastFrameEvent.js_name}
 
 
 class ChromewhipException(Exception):
@@ -34,26 +44,59 @@ class JSScriptError(ChromewhipException):
     pass
 
 
+class TabCrashedError(ChromewhipException):
+    """ The tab's renderer crashed, hung or was detached, so it won't answer any more commands. """
+    pass
+
+
+class ConnectionLostError(ChromewhipException):
+    pass
+
+
 class ChromeTab(metaclass=SyncAdder):
 
-    def __init__(self, title, url, ws_uri, tab_id):
+    def __init__(self, title, url, ws_uri, tab_id, transport_factory=None):
+        """
+        :param transport_factory: coroutine function opening the `Transport` to the tab, by default its websocket
+        """
         self.id_ = tab_id
         self._title = title
         self._url = url
         self._ws_uri = ws_uri
-        self.target_id = ws_uri.split('/')[-1]
-        self._ws: Optional[websockets.WebSocketClientProtocol] = None
+        self._transport_factory = transport_factory
+        self.target_id = ws_uri.split('/')[-1] if ws_uri else tab_id
+        # the incognito browser context the tab was opened in, if any
+        self.browser_context_id = None
+        self._transport: Optional[Transport] = None
         self._message_id = 0
         self._current_task: Optional[asyncio.Task] = None
         self._ack_events = {}
         self._ack_payloads = {}
         self._input_events = {}
         self._trigger_events = {}
-        self._event_payloads = {}
+        self._event_payloads = OrderedDict()
+        self._event_listeners = {}
+        self._compiled_scripts = {}
+        self._evaluated_scripts = set()
+        self._injected_scripts = {}
+        # state applied over the current connection, so commands that wouldn't change anything can be skipped
+        self._device_metrics = None
+        self._enabled_domains = set()
+        self._domain_users = {}
+        self._domains_lock = None
+        self._pending_disables = {}
+        # set once the tab can no longer answer, failing every command waiting on it
+        self._failure = None
         self._recv_task = None
+        # bumped by every connect, so retries racing to reconnect after the same failure only reconnect once
+        self._generation = 0
+        self._connection_lock = None
         self._log = logging.getLogger('chromewhip.chrome.ChromeTab')
         self._send_log = logging.getLogger('chromewhip.chrome.ChromeTab.send_handler')
         self._recv_log = logging.getLogger('chromewhip.chrome.ChromeTab.recv_handler')
+        self.add_event_listener(page.FrameNavigatedEvent, self._on_frame_navigated)
+        self.add_event_listener(inspector.TargetCrashedEvent, self._on_target_crashed)
+        self.add_event_listener(inspector.DetachedEvent, self._on_detached)
 
     @classmethod
     async def create_from_json(cls, json_, host, port):
@@ -67,52 +110,109 @@ class ChromeTab(metaclass=SyncAdder):
         await t.connect()
         return t
 
+    @property
+    def _connect_lock(self) -> asyncio.Lock:
+        if self._connection_lock is None:
+            self._connection_lock = asyncio.Lock()
+        return self._connection_lock
+
     async def connect(self):
-        self._ws = await websockets.connect(self._ws_uri, max_size=MAX_PAYLOAD_SIZE_BYTES)  # 16MB
+        async with self._connect_lock:
+            await self._connect()
+
+    async def _reconnect(self, generation: int):
+        """ Reconnect after the connection of `generation` was lost, unless another command already has. """
+        async with self._connect_lock:
+            if generation == self._generation:
+                await self._connect()
+
+    async def _connect(self):
+        await self._close_transport()
+        self._generation += 1
+        if self._transport_factory:
+            self._transport = await self._transport_factory()
+        else:
+            self._transport = await WebSocketTransport.connect(self._ws_uri, max_size=MAX_PAYLOAD_SIZE_BYTES)
+        # a new devtools session starts without any emulation, enabled domains, compiled or injected scripts
+        self._device_metrics = None
+        self._enabled_domains = set()
+        self._compiled_scripts = {}
+        self._injected_scripts = {}
+        self._failure = None
         self._recv_task = asyncio.ensure_future(self.recv_handler())
-        self._log.info('Connected to Chrome tab %s' % self._ws_uri)
+        self._log.info('Connected to Chrome tab %s' % (self._ws_uri or self.id_))
+        # domains still in use are enabled again, bypassing `enable` as its lock may be held by the caller retrying
+        for domain in [d for d, users in self._domain_users.items() if users]:
+            await self._send({'method': '%s.enable' % domain, 'params': {}})
+            self._enabled_domains.add(domain)
 
     async def disconnect(self):
         self._log.debug("Disconnecting tab...")
         if self._current_task and not self._current_task.done() and not self._current_task.cancelled():
-            self._log.warning('Cancelling current task for websocket')
+            self._log.warning('Cancelling current task for transport')
             self._current_task.cancel()
             await self._current_task
         if self._recv_task:
             self._recv_task.cancel()
             await self._recv_task
 
+    async def _close_transport(self):
+        """ Stop receiving from the previous connection, if any, and close it. """
+        if self._transport:
+            # commands waiting on it would otherwise only find out once they time out
+            self.fail(ConnectionLostError('Connection to tab %s was closed to reconnect' % self.id_))
+        if self._recv_task:
+            self._recv_task.cancel()
+            await asyncio.gather(self._recv_task, return_exceptions=True)
+            self._recv_task = None
+        # a receive loop cancelled before it started, or already stopped, hasn't closed it
+        if self._transport:
+            await self._transport.close()
+
     async def recv_handler(self):
         try:
             while True:
                 self._recv_log.debug('Waiting for message...')
-                result = await self._ws.recv()
+                result = await self._transport.recv()
                 self._recv_log.debug('Received message, processing...')
 
                 if not result:
                     self._recv_log.error('Missing message, may have been a connection timeout...')
                     continue
-                result = json.loads(result)
 
                 if not isinstance(result, dict):
                     self._recv_log.error('decoded messages is of type "%s" and = "%s"' % (type(result), result))
                     continue
                 if 'id' in result:
-                    self._ack_payloads[result['id']] = result
                     ack_event = self._ack_events.get(result['id'])
                     if ack_event is None:
+                        # e.g. the command timed out or was cancelled
                         self._recv_log.error('Ignoring ack with id %s as no registered recv' % result['id'])
                         continue
+                    self._ack_payloads[result['id']] = result
                     self._recv_log.debug('Notifying ack event with id=%s' % (result['id']))
                     ack_event.set()
 
                 elif 'method' in result:
                     self._recv_log.debug('Received event message!')
-                    event = helpers.json_to_event(result)
+                    try:
+                        event = helpers.json_to_event(result)
+                    except (AttributeError, KeyError, TypeError) as e:
+                        self._recv_log.error('Unable to deserialise event "%s": %s' % (result['method'], e))
+                        continue
+                    if event is None:
+                        continue
                     self._recv_log.debug('Received a "%s" event , storing against hash and name...' % event.js_name)
                     hash_ = event.hash_()
-                    self._event_payloads[hash_] = event
-                    self._event_payloads[event.js_name] = event
+                    if event.js_name not in UNSTORED_EVENTS:
+                        self._store_event(hash_, event)
+                        self._store_event(event.js_name, event)
+
+                    for callback in list(self._event_listeners.get(event.js_name, ())):
+                        try:
+                            callback(event)
+                        except Exception:
+                            self._recv_log.exception('Listener %s failed on "%s" event' % (callback, event.js_name))
 
                     # first, check if any requests are waiting upon it
                     input_event = self._input_events.get(event.js_name)
@@ -128,8 +228,72 @@ class ChromeTab(metaclass=SyncAdder):
                     # TODO: deal with invalid state
                     self._recv_log.info('Invalid message %s, what do i do now?' % result)
 
+        except TransportClosed as e:
+            self._recv_log.warning('Connection to tab closed: %s' % e)
+            self.fail(ConnectionLostError('Connection to tab %s closed with code %s' % (self.id_, e.code)))
         except asyncio.CancelledError:
-            await self._ws.close()
+            await self._transport.close()
+
+    @property
+    def is_alive(self) -> bool:
+        return not isinstance(self._failure, TabCrashedError)
+
+    def fail(self, error: ChromewhipException):
+        """
+        Fail every command waiting on the tab with `error` straight away, as well as any sent after, until the tab
+        reconnects. Only a `ConnectionLostError` is retried by `send_command`.
+        """
+        if isinstance(self._failure, TabCrashedError):
+            return
+        self._failure = error
+        for event in list(self._ack_events.values()) + list(self._input_events.values()) + \
+                list(self._trigger_events.values()):
+            event.set()
+
+    def _on_target_crashed(self, event: inspector.TargetCrashedEvent):
+        self._log.error('Tab %s crashed!' % self.id_)
+        self.fail(TabCrashedError('Tab %s crashed' % self.id_))
+
+    def _on_detached(self, event: inspector.DetachedEvent):
+        self._log.error('Tab %s was detached: %s' % (self.id_, event.reason))
+        self.fail(TabCrashedError('Tab %s was detached: %s' % (self.id_, event.reason)))
+
+    async def _wait(self, event: asyncio.Event, generation: int):
+        await asyncio.wait_for(event.wait(), timeout=TIMEOUT_S)
+        if self._failure:
+            raise type(self._failure)(*self._failure.args)
+        if generation != self._generation:
+            # woken by the failure of a connection that was replaced since
+            raise ConnectionLostError('Connection to tab %s was lost' % self.id_)
+
+    async def ping(self, timeout: float) -> bool:
+        """
+        :return: whether the renderer evaluated a trivial expression within `timeout`, which a hung renderer won't.
+        Any other failure, such as a lost connection, is raised as the renderer may well be fine
+        """
+        try:
+            await asyncio.wait_for(self._send(*runtime.Runtime.evaluate('1')), timeout=timeout)
+            return True
+        except (asyncio.TimeoutError, TimeoutError):
+            return False
+
+    def _store_event(self, key, event):
+        self._event_payloads[key] = event
+        self._event_payloads.move_to_end(key)
+        if len(self._event_payloads) > MAX_STORED_EVENTS:
+            self._event_payloads.popitem(last=False)
+
+    def add_event_listener(self, event_cls, callback):
+        """
+        Call `callback` with every event of type `event_cls` received from now on. Callbacks are run synchronously
+        from the receive loop, so they must be quick and should schedule any commands they need to send.
+        """
+        self._event_listeners.setdefault(event_cls.js_name, []).append(callback)
+
+    def remove_event_listener(self, event_cls, callback):
+        listeners = self._event_listeners.get(event_cls.js_name, [])
+        if callback in listeners:
+            listeners.remove(callback)
 
     @staticmethod
     async def validator(result: dict, types: dict):
@@ -152,6 +316,10 @@ class ChromeTab(metaclass=SyncAdder):
         :param trigger_event_cls:
         :return:
         """
+        if self._failure:
+            raise type(self._failure)(*self._failure.args)
+
+        generation = self._generation
         self._message_id += 1
         request['id'] = self._message_id
 
@@ -172,13 +340,13 @@ class ChromeTab(metaclass=SyncAdder):
         result = {'ack': None, 'event': None}
 
         try:
-            msg = json.dumps(request, cls=helpers.ChromewhipJSONEncoder)
-            self._send_log.info('Sending command = %s' % msg)
-            self._current_task = asyncio.ensure_future(self._ws.send(msg))
+            # the transport encodes the request
+            self._send_log.debug('Sending command = %s', request)
+            self._current_task = asyncio.ensure_future(self._transport.send(request))
             await asyncio.wait_for(self._current_task, timeout=TIMEOUT_S)  # send
 
             self._send_log.debug('Waiting for ack event set for id=%s' % request['id'])
-            await asyncio.wait_for(ack_event.wait(), timeout=TIMEOUT_S)  # recv
+            await self._wait(ack_event, generation)  # recv
             self._send_log.debug('Received ack event set for id=%s' % request['id'])
 
             ack_payload = self._ack_payloads.get(request['id'])
@@ -193,6 +361,7 @@ class ChromeTab(metaclass=SyncAdder):
             if error:
                 msg = '%s, code %s for id=%s' % (error.get('message', 'Unknown error'), error['code'], request['id'])
                 self._send_log.error(msg)
+                metrics.CDP_ERRORS.inc(method=request['method'], error='protocol')
                 raise ProtocolError(msg)
 
             if recv_validator:
@@ -212,7 +381,7 @@ class ChromeTab(metaclass=SyncAdder):
                 hash_input_dict = {}
                 if not event:
                     self._send_log.debug('Waiting for event with hash "%s"...' % hash_)
-                    await asyncio.wait_for(input_event.wait(), timeout=TIMEOUT_S)  # recv
+                    await self._wait(input_event, generation)  # recv
                     event = self._event_payloads.get(hash_)
 
                 params = event.hash_().split(':')[-1].split(',')
@@ -235,18 +404,19 @@ class ChromeTab(metaclass=SyncAdder):
                     self._send_log.debug('Waiting for event with hash "%s"...' % hash_)
                     trigger_event = asyncio.Event()
                     self._trigger_events[hash_] = trigger_event
-                    await asyncio.wait_for(trigger_event.wait(), timeout=TIMEOUT_S)  # recv
+                    await self._wait(trigger_event, generation)  # recv
                     event = self._event_payloads.get(hash_)
                 result['event'] = event
 
-            self._send_log.info('Successfully sent command = %s' % msg)
+            self._send_log.debug('Successfully sent command = %s', request)
             return result
         except asyncio.TimeoutError:
             method = request['method']
             id_ = request['id']
-            self._send_log.error(msg)
-            if self._ws.state != websockets.protocol.State.OPEN:
-                close_code = self._ws.close_code
+            metrics.CDP_ERRORS.inc(method=method, error='timeout')
+            self._send_log.error('Timed out on command "%s" with id=%s', method, id_)
+            close_code = self._transport.close_code
+            if close_code:
                 if close_code == 1002:
                     raise ProtocolError('Websocket protocol error occured for "%s" with id=%s' % (method, id_))
                 elif close_code == 1006:
@@ -254,13 +424,16 @@ class ChromeTab(metaclass=SyncAdder):
                 elif close_code == 1007:
                     raise ProtocolError('Unicode decode error occured for "%s" with id=%s' % (method, id_))
                 elif close_code == 1009:
-                    raise ProtocolError('Recv\'d payload exceeded %sMB for "%s" with id=%s, consider increasing this limit' % (MAX_PAYLOAD_SIZE_MB, method, id_))
+                    raise ProtocolError('Recv\'d payload exceeded %sMB for "%s" with id=%s, consider reading it as a stream with `read_stream`' % (MAX_PAYLOAD_SIZE_MB, method, id_))
             raise TimeoutError('Unknown cause for timeout to occurs for "%s" with id=%s' % (method, id_))
+        finally:
+            self._ack_events.pop(request['id'], None)
+            self._ack_payloads.pop(request['id'], None)
 
     async def new_message_handler(self, request):
         request['id'] = self._message_id
-        await self._ws.send(json.dumps(request))
-        return await self._ws.recv()
+        await self._transport.send(request)
+        return await self._transport.recv()
 
     @property
     def title(self):
@@ -275,21 +448,90 @@ class ChromeTab(metaclass=SyncAdder):
         return self._ws_uri
 
     async def enable_page_events(self):
-        return await self._send(*page.Page.enable())
+        """
+        Deprecated, use `enable('Page')` paired with `disable('Page')` instead
+        """
+        warnings.warn('enable_page_events is deprecated, use enable("Page") and disable("Page")', DeprecationWarning,
+                      stacklevel=2)
+        await self.enable('Page')
+
+    @property
+    def _lock(self) -> asyncio.Lock:
+        if self._domains_lock is None:
+            self._domains_lock = asyncio.Lock()
+        return self._domains_lock
+
+    async def enable(self, domain: str):
+        """
+        Enable a domain such as `Network` on behalf of one more user, only sending `<domain>.enable` when the domain
+        isn't enabled already. Every call must be paired with a call to `disable`.
+        """
+        self._domain_users[domain] = self._domain_users.get(domain, 0) + 1
+        # supersedes any disable still waiting out its delay
+        self._pending_disables.pop(domain, None)
+        async with self._lock:
+            if domain in self._enabled_domains:
+                return
+            try:
+                await self.send_command(({'method': '%s.enable' % domain, 'params': {}}, None))
+            except Exception:
+                self._domain_users[domain] -= 1
+                raise
+            self._enabled_domains.add(domain)
+
+    async def disable(self, domain: str):
+        """
+        Release a domain enabled with `enable`. Once it has no users left, the domain is disabled after
+        `DOMAIN_DISABLE_DELAY_S`, so its events stop flowing without a busy tab paying a round trip each render.
+        """
+        users = self._domain_users.get(domain, 0)
+        if not users:
+            raise ValueError('Domain "%s" was not enabled' % domain)
+        self._domain_users[domain] = users - 1
+        if users == 1:
+            self._pending_disables[domain] = asyncio.ensure_future(self._disable_later(domain))
+
+    async def _disable_later(self, domain: str):
+        await asyncio.sleep(DOMAIN_DISABLE_DELAY_S)
+        if self._pending_disables.get(domain) is not asyncio.current_task():
+            return
+        del self._pending_disables[domain]
+        async with self._lock:
+            if self._domain_users.get(domain) or domain not in self._enabled_domains:
+                return
+            try:
+                await self.send_command(({'method': '%s.disable' % domain, 'params': {}}, None))
+            except ChromewhipException as e:
+                self._log.warning('Unable to disable domain "%s": %s' % (domain, e))
+                return
+            self._enabled_domains.discard(domain)
+
+    async def set_device_metrics(self, width: int, height: int, device_scale_factor: float = 0.0,
+                                 mobile: bool = False):
+        """
+        Override the device metrics of the tab, unless they are already the ones applied
+        """
+        device_metrics = (width, height, device_scale_factor, mobile)
+        if device_metrics == self._device_metrics:
+            return
+        await self.send_command(page.Page.setDeviceMetricsOverride(width=width,
+                                                                   height=height,
+                                                                   deviceScaleFactor=device_scale_factor,
+                                                                   mobile=mobile))
+        self._device_metrics = device_metrics
 
     async def send_command(self, command, input_event_type=None, await_on_event_type=None):
-        finished = False
         retries = 0
-        max_retries = 3
-        while not finished:
+        while True:
+            generation = self._generation
             try:
                 return await self._send(*command, input_event_cls=input_event_type, trigger_event_cls=await_on_event_type)
-            except websockets.exceptions.ConnectionClosed:
-                if retries > max_retries:
-                    self._log.error(f'Failed to execute send command {command} after {retries} times!')
-                    finished = True
-                await self.connect()
-
+            except (TransportClosed, ConnectionLostError) as e:
+                if retries >= MAX_SEND_RETRIES:
+                    self._log.error(f'Failed to execute send command {command} after {retries} retries!')
+                    raise ConnectionLostError('Unable to send "%s" to tab %s: %s' % (command[0]['method'], self.id_, e))
+                retries += 1
+                await self._reconnect(generation)
 
 
     async def html(self):
@@ -297,11 +539,140 @@ class ChromeTab(metaclass=SyncAdder):
         value = result['ack']['result']['result'].value
         return value.encode('utf-8')
 
-    async def screenshot(self):
-        result = await self.send_command(page.Page.captureScreenshot(format='png', fromSurface=False))
+    async def screenshot(self, format_: str = 'png', quality: Optional[int] = None,
+                         clip: Optional[page.Viewport] = None):
+        result = await self.send_command(page.Page.captureScreenshot(format=format_,
+                                                                     quality=quality,
+                                                                     clip=clip,
+                                                                     fromSurface=False))
         base64_data = result['ack']['result']['data']
         return base64.b64decode(base64_data)
 
+    async def read_stream(self, handle: str, chunk_size: int = IO_READ_CHUNK_BYTES):
+        """
+        Read the IO domain stream `handle` chunk by chunk, so that large payloads are never held in memory as a
+        whole, nor sent in a single message. The stream is closed once read, or once the iterator is closed.
+
+        :return: async iterator of bytes
+        """
+        try:
+            while True:
+                result = await self.send_command(io.IO.read(handle, size=chunk_size))
+                ack = result['ack']['result']
+                if ack['data']:
+                    yield base64.b64decode(ack['data']) if ack.get('base64Encoded') else ack['data'].encode('utf-8')
+                if ack['eof']:
+                    break
+        finally:
+            try:
+                await self.send_command(io.IO.close(handle))
+            except ChromewhipException as e:
+                self._log.warning('Unable to close stream %s: %s' % (handle, e))
+
+    async def print_to_pdf(self, **options):
+        """
+        :param options: any of the `Page.printToPDF` parameters
+        :return: async iterator of the PDF's bytes
+        """
+        result = await self.send_command(page.Page.printToPDF(transferMode='ReturnAsStream', **options))
+        return self.read_stream(result['ack']['result']['stream'])
+
+    async def start_tracing(self, categories: str = None):
+        await self.send_command(tracing.Tracing.start(categories=categories, transferMode='ReturnAsStream'))
+
+    async def end_tracing(self):
+        """
+        :return: async iterator of the JSON trace recorded since `start_tracing`
+        """
+        complete = asyncio.get_event_loop().create_future()
+
+        def on_complete(event: tracing.TracingCompleteEvent):
+            if not complete.done():
+                complete.set_result(event)
+
+        self.add_event_listener(tracing.TracingCompleteEvent, on_complete)
+        try:
+            await self.send_command(tracing.Tracing.end())
+            event = await asyncio.wait_for(complete, timeout=TIMEOUT_S)
+        finally:
+            self.remove_event_listener(tracing.TracingCompleteEvent, on_complete)
+        return self.read_stream(event.stream)
+
+    async def response_body_stream(self, request_id: str):
+        """
+        :param request_id: of a request paused by the Fetch domain at the `Response` stage
+        :return: async iterator of the response body
+        """
+        result = await self.send_command(fetch.Fetch.takeResponseBodyAsStream(request_id))
+        return self.read_stream(result['ack']['result']['stream'])
+
+    def _on_frame_navigated(self, event: page.FrameNavigatedEvent):
+        if not event.frame.parentId:
+            # scripts run in the main frame's context, which a new document replaces
+            self._compiled_scripts.clear()
+            self._evaluated_scripts.clear()
+
+    async def _compile_script(self, javascript: str, source_url: str):
+        result = await self.send_command(runtime.Runtime.compileScript(javascript, sourceURL=source_url,
+                                                                       persistScript=True))
+        ack = result['ack']['result']
+        if ack.get('exceptionDetails'):
+            raise JSScriptError({
+                'reason': 'Runtime.compileScript threw an error',
+                'error': ack['exceptionDetails'].to_dict()
+            })
+        self._compiled_scripts[javascript] = ack['scriptId']
+        return ack['scriptId']
+
+    async def _run_compiled_script(self, script_id):
+        result = await self.send_command(runtime.Runtime.runScript(script_id))
+        r = result["ack"]["result"]["result"]
+        if r.subtype == 'error':
+            raise JSScriptError({
+                'reason': 'Runtime.runScript threw an error',
+                'error': result["ack"]["result"]["exceptionDetails"].to_dict()
+            })
+        return result
+
+    async def run_script(self, javascript, source_url=''):
+        """
+        Run JavaScript on the page like `evaluate`. The first run in a document is a single `Runtime.evaluate`, a
+        script run again in the same document is compiled once so later runs refer to it by id rather than sending
+        the whole source again
+        """
+        if javascript not in self._compiled_scripts and javascript not in self._evaluated_scripts:
+            result = await self.evaluate(javascript + '\n//# sourceURL=%s' % source_url if source_url else javascript)
+            self._evaluated_scripts.add(javascript)
+            return result
+        # V8 only keeps compiled scripts while the Runtime domain is enabled
+        await self.enable('Runtime')
+        try:
+            script_id = self._compiled_scripts.get(javascript)
+            if script_id is not None:
+                try:
+                    return await self._run_compiled_script(script_id)
+                except ProtocolError:
+                    self._log.debug('Compiled script %s is gone, compiling again' % script_id)
+                    self._compiled_scripts.pop(javascript, None)
+            script_id = await self._compile_script(javascript, source_url)
+            return await self._run_compiled_script(script_id)
+        finally:
+            await self.disable('Runtime')
+
+    async def set_injected_scripts(self, scripts):
+        """
+        Make `scripts` the only JavaScript run in every new document before the page's own scripts, only adding and
+        removing scripts that changed since the last call
+        """
+        wanted = set(scripts)
+        for javascript in [s for s in self._injected_scripts if s not in wanted]:
+            identifier = self._injected_scripts.pop(javascript)
+            await self.send_command(page.Page.removeScriptToEvaluateOnNewDocument(identifier))
+        for javascript in scripts:
+            if javascript not in self._injected_scripts:
+                result = await self.send_command(page.Page.addScriptToEvaluateOnNewDocument(javascript))
+                self._injected_scripts[javascript] = result['ack']['result']['identifier']
+
     async def go(self, url):
         """
         Navigate the tab to the URL
@@ -309,11 +680,11 @@ class ChromeTab(metaclass=SyncAdder):
         return await self.send_command(page.Page.navigate(url),
                                        await_on_event_type=page.FrameStoppedLoadingEvent)
 
-    async def evaluate(self, javascript):
+    async def evaluate(self, javascript, context_id=None):
         """
-        Evaluate JavaScript on the page
+        Evaluate JavaScript on the page, or within the execution context of `context_id` if given
         """
-        result = await self.send_command(runtime.Runtime.evaluate(javascript))
+        result = await self.send_command(runtime.Runtime.evaluate(javascript, contextId=context_id))
         r = result["ack"]["result"]["result"]
         if r.subtype == 'error':
             raise JSScriptError({
@@ -336,6 +707,9 @@ class Chrome(metaclass=SyncAdder):
         self._port = port
         self._url = 'http://%s:%d' % (self.host, self.port)
         self._tabs = []
+        self._browser = None
+        self._browser_lock = None
+        self._pipe: Optional[PipeConnection] = None
         self.is_connected = False
         self._log = logging.getLogger('chromewhip.chrome.Chrome')
 
@@ -349,6 +723,14 @@ class Chrome(metaclass=SyncAdder):
                 self._log.error('Unable to fetch tabs! Timeout')
 
     async def attempt_tab_fetch(self):
+        if self._pipe:
+            session = await self._browser_session()
+            result = await session.send_command(target.Target.getTargets())
+            self._tabs = [await self._open_tab(t.targetId, t.title, t.url)
+                          for t in result['ack']['result']['targetInfos'] if t.type == 'page']
+            self._log.debug("Connected to Chrome! Found {} tabs".format(len(self._tabs)))
+            self.is_connected = True
+            return
         async with aiohttp.ClientSession() as session:
             async with session.get(self._url + '/json') as resp:
                 tabs = []
@@ -362,6 +744,41 @@ class Chrome(metaclass=SyncAdder):
                 self._log.debug("Connected to Chrome! Found {} tabs".format(len(self._tabs)))
         self.is_connected = True
 
+    def use_pipe(self, connection: PipeConnection):
+        """
+        Talk to a Chrome launched with `--remote-debugging-pipe` over `connection`, rather than its HTTP and websocket
+        endpoints.
+        """
+        if self._pipe:
+            asyncio.ensure_future(self._pipe.close())
+        self._pipe = connection
+        self.reset()
+
+    def reset(self):
+        """ Forget the tabs of a browser that went away, so that `connect` fetches those of the next one """
+        self._tabs = []
+        if self._browser:
+            asyncio.ensure_future(self._browser.disconnect())
+        self._browser = None
+        self.is_connected = False
+
+    async def ping(self, timeout: float) -> bool:
+        """
+        :return: whether the browser answered on its devtools HTTP endpoint, or its pipe, within `timeout`
+        """
+        if self._pipe:
+            try:
+                session = await asyncio.wait_for(self._browser_session(), timeout=timeout)
+                await asyncio.wait_for(session.send_command(browser.Browser.getVersion()), timeout=timeout)
+                return True
+            except (asyncio.TimeoutError, ChromewhipException, TransportClosed):
+                return False
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(self._url + '/json/version', timeout=timeout) as resp:
+                    return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
 
     @property
     def host(self):
@@ -381,7 +798,52 @@ class Chrome(metaclass=SyncAdder):
             raise ValueError('Must call connect_s or connect first!')
         return tuple(self._tabs)
 
-    async def create_tab(self):
+    async def _browser_session(self) -> ChromeTab:
+        """ The browser wide devtools session, for commands no tab takes like `Target.createBrowserContext`. """
+        if self._browser_lock is None:
+            self._browser_lock = asyncio.Lock()
+        async with self._browser_lock:
+            if self._browser is None:
+                if self._pipe:
+                    browser = ChromeTab('browser', '', None, 'browser', transport_factory=self._pipe_session)
+                else:
+                    async with aiohttp.ClientSession() as session:
+                        async with session.get(self._url + '/json/version') as resp:
+                            data = await resp.json()
+                    browser = ChromeTab('browser', '', data['webSocketDebuggerUrl'], 'browser')
+                await browser.connect()
+                self._browser = browser
+        return self._browser
+
+    async def _pipe_session(self, target_id: str = None) -> Transport:
+        """ A flat session over the pipe to the target, or to the browser itself without `target_id`. """
+        if target_id is None:
+            return self._pipe.session()
+        session = await self._browser_session()
+        result = await session.send_command(target.Target.attachToTarget(target_id, flatten=True))
+        return self._pipe.session(result['ack']['result']['sessionId'])
+
+    async def _open_tab(self, target_id: str, title: str = '', url: str = 'about:blank') -> ChromeTab:
+        if not self._pipe:
+            return await ChromeTab.create_from_json({'id': target_id, 'title': title, 'url': url},
+                                                    self._host, self._port)
+        t = ChromeTab(title, url, None, target_id, transport_factory=functools.partial(self._pipe_session, target_id))
+        await t.connect()
+        return t
+
+    async def create_tab(self, incognito: bool = False):
+        """
+        :param incognito: open the tab in a browser context of its own, sharing no cookies, storage or cache with
+        any other tab. The context is disposed of along with the tab by `close_tab`.
+        """
+        if incognito:
+            return await self._create_incognito_tab()
+        if self._pipe:
+            session = await self._browser_session()
+            result = await session.send_command(target.Target.createTarget('about:blank'))
+            t = await self._open_tab(result['ack']['result']['targetId'])
+            self._tabs.append(t)
+            return t
         async with aiohttp.ClientSession() as session:
             async with session.get(self._url + '/json/new') as resp:
                 data = await resp.json()
@@ -389,8 +851,33 @@ class Chrome(metaclass=SyncAdder):
                 self._tabs.append(t)
         return t
 
+    async def _create_incognito_tab(self):
+        browser = await self._browser_session()
+        result = await browser.send_command(target.Target.createBrowserContext())
+        context_id = result['ack']['result']['browserContextId']
+        try:
+            result = await browser.send_command(target.Target.createTarget('about:blank', browserContextId=context_id))
+            t = await self._open_tab(result['ack']['result']['targetId'])
+        except Exception:
+            await browser.send_command(target.Target.disposeBrowserContext(context_id))
+            raise
+        t.browser_context_id = context_id
+        self._tabs.append(t)
+        return t
+
     async def close_tab(self, tab):
         await tab.disconnect()
+        if tab in self._tabs:
+            self._tabs.remove(tab)
+        if tab.browser_context_id:
+            # closes the tab too
+            browser = await self._browser_session()
+            await browser.send_command(target.Target.disposeBrowserContext(tab.browser_context_id))
+            return
+        if self._pipe:
+            session = await self._browser_session()
+            await session.send_command(target.Target.closeTarget(tab.target_id))
+            return
         async with aiohttp.ClientSession() as session:
             await session.get(self._url + f'/json/close/{tab.id_}')
 
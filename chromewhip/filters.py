@@ -0,0 +1,339 @@
+""" Request filtering with Adblock Plus / EasyList style rules.
+
+Rules are compiled once into a `FilterEngine`, which picks candidate rules for a URL with a trie of domain labels for
+`||domain^` rules and an Aho-Corasick automaton over a literal token of every other rule. Only those few candidates
+are then verified with their regex, so matching cost does not grow with the size of the list.
+
+https://help.eyeo.com/en/adblockplus/how-to-write-filters
+"""
+import hashlib
+import logging
+import os
+import pickle
+import re
+from collections import deque, namedtuple
+from urllib.parse import urlsplit
+
+# bump whenever the pickled layout of `FilterEngine` changes, so stale caches are ignored
+CACHE_FORMAT_VERSION = 1
+DEFAULT_FILTER_NAME = 'default'
+NO_FILTERS = 'none'
+
+# devtools resource types to the option names used by filter lists
+RESOURCE_TYPE_OPTIONS = {
+    'Document': 'subdocument',
+    'Stylesheet': 'stylesheet',
+    'Image': 'image',
+    'Media': 'media',
+    'Font': 'font',
+    'Script': 'script',
+    'XHR': 'xmlhttprequest',
+    'Fetch': 'xmlhttprequest',
+    'WebSocket': 'websocket',
+    'Ping': 'ping',
+}
+TYPE_OPTIONS = frozenset(RESOURCE_TYPE_OPTIONS.values()) | {'other', 'object'}
+
+SEPARATOR_REGEX = r'(?:[^\w\-.%]|$)'
+DOMAIN_ANCHOR_REGEX = r'^[\w\-]+:/+(?:[^/?#]*\.)?'
+HOST_END_CHARS = '^/'
+
+log = logging.getLogger('chromewhip.filters')
+
+Rule = namedtuple('Rule', ['raw', 'pattern', 'regex', 'third_party', 'types', 'excluded_types', 'domains',
+                           'excluded_domains'])
+
+
+def _host(url: str) -> str:
+    return (urlsplit(url).hostname or '').lower()
+
+
+def _base_domain(host: str) -> str:
+    return '.'.join(host.rsplit('.', 2)[-2:])
+
+
+def _is_subdomain(host: str, domains) -> bool:
+    labels = host.split('.')
+    return any('.'.join(labels[i:]) in domains for i in range(len(labels)))
+
+
+def _pattern_to_regex(pattern: str) -> str:
+    start, end = '', ''
+    if pattern.startswith('||'):
+        start, pattern = DOMAIN_ANCHOR_REGEX, pattern[2:]
+    elif pattern.startswith('|'):
+        start, pattern = '^', pattern[1:]
+    if pattern.endswith('|'):
+        end, pattern = '$', pattern[:-1]
+    body = re.escape(pattern).replace(r'\*', '.*').replace(r'\^', SEPARATOR_REGEX)
+    return start + body + end
+
+
+def _parse_options(raw_options: str):
+    """
+    :return: a tuple of option fields for `Rule`, or None if the rule uses an option that isn't supported
+    """
+    third_party = None
+    types, excluded_types = set(), set()
+    domains, excluded_domains = set(), set()
+    for option in raw_options.lower().split(','):
+        negated = option.startswith('~')
+        name = option.lstrip('~')
+        if name == 'third-party':
+            third_party = not negated
+        elif name == 'match-case':
+            continue
+        elif name in TYPE_OPTIONS:
+            (excluded_types if negated else types).add(name)
+        elif option.startswith('domain='):
+            for domain in option[len('domain='):].split('|'):
+                if domain.startswith('~'):
+                    excluded_domains.add(domain[1:])
+                else:
+                    domains.add(domain)
+        else:
+            return None
+    return third_party, frozenset(types), frozenset(excluded_types), frozenset(domains), frozenset(excluded_domains)
+
+
+def parse_rule(line: str):
+    """
+    Parse a single line of a filter list.
+
+    :return: a tuple of (`Rule`, is_exception), or None for comments, element hiding and unsupported rules
+    """
+    line = line.strip()
+    if not line or line.startswith(('!', '[')) or '##' in line or '#@#' in line or '#?#' in line:
+        return None
+
+    is_exception = line.startswith('@@')
+    if is_exception:
+        line = line[2:]
+
+    pattern, options = line, (None, frozenset(), frozenset(), frozenset(), frozenset())
+    if '$' in line:
+        pattern, raw_options = line.rsplit('$', 1)
+        options = _parse_options(raw_options)
+        if options is None:
+            return None
+
+    if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+        # raw regex rules can't be indexed, and the lists recommend against them anyway
+        return None
+
+    pattern = pattern.lower()
+    return Rule(line, pattern, _pattern_to_regex(pattern), *options), is_exception
+
+
+def _rule_host(pattern: str):
+    """
+    :return: the host of a `||host^` style rule, if the rule is anchored to the end of a whole host
+    """
+    if not pattern.startswith('||'):
+        return None
+    rest = pattern[2:]
+    for i, c in enumerate(rest):
+        if c in HOST_END_CHARS:
+            return rest[:i] if i else None
+        if c in '*|$':
+            return None
+    return None
+
+
+def _literal_token(pattern: str) -> str:
+    tokens = re.split(r'[*^|]+', pattern.lstrip('|'))
+    return max(tokens, key=len) if tokens else ''
+
+
+class _RuleSet:
+    def __init__(self):
+        self.rules = []
+        self.regexes = {}
+        self.domain_trie = {}
+        self.generic = []
+        # Aho-Corasick automaton, where each state is an index into these lists
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def __getstate__(self):
+        # compiled regexes are rebuilt lazily rather than pickled
+        state = self.__dict__.copy()
+        state['regexes'] = {}
+        return state
+
+    def add(self, rule: Rule):
+        index = len(self.rules)
+        self.rules.append(rule)
+
+        host = _rule_host(rule.pattern)
+        if host:
+            node = self.domain_trie
+            for label in reversed(host.split('.')):
+                node = node.setdefault(label, {})
+            node.setdefault(None, []).append(index)
+            return
+
+        token = _literal_token(rule.pattern)
+        if not token:
+            self.generic.append(index)
+            return
+        state = 0
+        for c in token:
+            if c not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][c] = len(self.goto) - 1
+            state = self.goto[state][c]
+        self.output[state].append(index)
+
+    def build(self):
+        """ Compute the failure links of the automaton, once every rule is added. """
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(c, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def candidates(self, url: str, host: str) -> set:
+        found = set(self.generic)
+
+        node = self.domain_trie
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            found.update(node.get(None, ()))
+
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for c in url:
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def regex(self, index: int):
+        regex = self.regexes.get(index)
+        if regex is None:
+            regex = self.regexes[index] = re.compile(self.rules[index].regex)
+        return regex
+
+
+class FilterEngine:
+    """ A compiled filter list, safe to share between every tab as matching doesn't mutate it. """
+
+    def __init__(self):
+        self._blocking = _RuleSet()
+        self._exceptions = _RuleSet()
+
+    def __len__(self):
+        return len(self._blocking.rules) + len(self._exceptions.rules)
+
+    @classmethod
+    def from_lines(cls, lines) -> 'FilterEngine':
+        engine = cls()
+        skipped = 0
+        for line in lines:
+            parsed = parse_rule(line)
+            if parsed is None:
+                skipped += 1
+                continue
+            rule, is_exception = parsed
+            (engine._exceptions if is_exception else engine._blocking).add(rule)
+        engine._blocking.build()
+        engine._exceptions.build()
+        log.debug('compiled %s rules, skipped %s lines' % (len(engine), skipped))
+        return engine
+
+    @classmethod
+    def from_file(cls, path: str, cache_dir: str = None) -> 'FilterEngine':
+        """
+        Compile the filter list at `path`. With `cache_dir`, the compiled engine is pickled there keyed by the
+        content of the list, so later startups skip parsing unless the list changes.
+        """
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        cache_fp = None
+        if cache_dir:
+            digest = hashlib.sha1(content + str(CACHE_FORMAT_VERSION).encode()).hexdigest()
+            cache_fp = os.path.join(cache_dir, '%s.%s.pickle' % (os.path.basename(path), digest))
+            try:
+                with open(cache_fp, 'rb') as f:
+                    log.debug('loading compiled filters for "%s" from "%s"' % (path, cache_fp))
+                    return pickle.load(f)
+            except FileNotFoundError:
+                pass
+            except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+                log.warning('ignoring unreadable filter cache "%s": %s' % (cache_fp, e))
+
+        engine = cls.from_lines(content.decode('utf-8', errors='replace').splitlines())
+
+        if cache_fp:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_fp = '%s.tmp%s' % (cache_fp, os.getpid())
+            with open(tmp_fp, 'wb') as f:
+                pickle.dump(engine, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fp, cache_fp)
+        return engine
+
+    def _matches(self, rule_set: _RuleSet, url: str, host: str, type_option: str, document_host: str) -> bool:
+        for index in rule_set.candidates(url, host):
+            rule = rule_set.rules[index]
+            if rule.types and type_option not in rule.types:
+                continue
+            if type_option in rule.excluded_types:
+                continue
+            if document_host:
+                if rule.domains and not _is_subdomain(document_host, rule.domains):
+                    continue
+                if rule.excluded_domains and _is_subdomain(document_host, rule.excluded_domains):
+                    continue
+                if rule.third_party is not None:
+                    is_third_party = _base_domain(host) != _base_domain(document_host)
+                    if rule.third_party != is_third_party:
+                        continue
+            elif rule.domains or rule.third_party is not None:
+                continue
+
+            if rule_set.regex(index).search(url):
+                return True
+        return False
+
+    def match(self, url: str, resource_type: str = None, document_url: str = None) -> bool:
+        """
+        :param url: the URL being requested
+        :param resource_type: devtools resource type of the request, e.g. `Script`
+        :param document_url: URL of the page making the request, needed for `domain=` and `third-party` rules
+        :return: whether the request should be blocked
+        """
+        url = url.lower()
+        host = _host(url)
+        document_host = _host(document_url) if document_url else ''
+        type_option = RESOURCE_TYPE_OPTIONS.get(resource_type, 'other')
+        if not self._matches(self._blocking, url, host, type_option, document_host):
+            return False
+        return not self._matches(self._exceptions, url, host, type_option, document_host)
+
+
+def load_filters(filters_path: str, cache_dir: str = None) -> {str: FilterEngine}:
+    """
+    Compile every `<name>.txt` filter list in `filters_path`, keyed by name as with splash's `--filters-path`.
+    """
+    filters = {}
+    for fn in sorted(os.listdir(filters_path)):
+        name, ext = os.path.splitext(fn)
+        if ext != '.txt':
+            continue
+        filters[name] = FilterEngine.from_file(os.path.join(filters_path, fn), cache_dir=cache_dir)
+        log.info('loaded filter "%s" with %s rules' % (name, len(filters[name])))
+    return filters
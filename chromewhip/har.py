@@ -0,0 +1,282 @@
+import asyncio
+import datetime
+import logging
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    # python 3.7, where only the backport has it
+    try:
+        import importlib_metadata
+    except ImportError:
+        importlib_metadata = None
+
+from chromewhip.chrome import ChromewhipException
+from chromewhip.protocol import network, page
+
+HAR_VERSION = '1.2'
+MAX_ENTRIES = 2000
+BODY_BUDGET_BYTES = 2 ** 23
+BODY_FETCH_CONCURRENCY = 8
+PAGE_ID = 'page_1'
+
+log = logging.getLogger('chromewhip.har')
+
+
+def _creator_version():
+    if importlib_metadata is None:
+        return 'unknown'
+    try:
+        return importlib_metadata.version('chromewhip')
+    except importlib_metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def _iso_datetime(epoch_s: float) -> str:
+    utc = datetime.datetime.fromtimestamp(epoch_s, datetime.timezone.utc)
+    return utc.replace(tzinfo=None).isoformat() + 'Z'
+
+
+def _name_values(items) -> [dict]:
+    return [{'name': k, 'value': v} for k, v in items]
+
+
+def _header_value(headers: dict, name: str, default=''):
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return default
+
+
+def _timings(timing: dict, finished_timestamp: float) -> dict:
+    """
+    Convert a devtools `ResourceTiming` into HAR timings, where -1 means the phase does not apply.
+    """
+    def span(start, end):
+        start, end = timing.get(start, -1), timing.get(end, -1)
+        return end - start if start >= 0 and end >= 0 else -1
+
+    starts = [timing.get(k, -1) for k in ('dnsStart', 'connectStart', 'sendStart')]
+    blocked = next((s for s in starts if s >= 0), 0)
+    receive = -1
+    if finished_timestamp is not None:
+        receive = max((finished_timestamp - timing['requestTime']) * 1000 - timing['receiveHeadersEnd'], 0)
+    return {
+        'blocked': blocked,
+        'dns': span('dnsStart', 'dnsEnd'),
+        'connect': span('connectStart', 'connectEnd'),
+        'ssl': span('sslStart', 'sslEnd'),
+        'send': max(span('sendStart', 'sendEnd'), 0),
+        'wait': max(span('sendEnd', 'receiveHeadersEnd'), 0),
+        'receive': receive,
+    }
+
+
+class HarCollector:
+    """ Builds a HAR 1.2 document from the Network events of a single render.
+
+    Events are folded into compact entries as they arrive, so at most `max_entries` requests are held in memory
+    no matter how much the page loads.
+    """
+    EVENT_TYPES = (
+        network.RequestWillBeSentEvent,
+        network.ResponseReceivedEvent,
+        network.LoadingFinishedEvent,
+        network.LoadingFailedEvent,
+        page.DomContentEventFiredEvent,
+        page.LoadEventFiredEvent,
+    )
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._redirect_count = 0
+        self._started = None
+        self._on_content_load = None
+        self._on_load = None
+        self.dropped = 0
+
+    async def attach(self, tab):
+        for event_cls in self.EVENT_TYPES:
+            tab.add_event_listener(event_cls, self.on_event)
+        await tab.enable('Network')
+
+    async def detach(self, tab):
+        for event_cls in self.EVENT_TYPES:
+            tab.remove_event_listener(event_cls, self.on_event)
+        await tab.disable('Network')
+
+    def on_event(self, event):
+        if isinstance(event, network.RequestWillBeSentEvent):
+            self._on_request_will_be_sent(event)
+        elif isinstance(event, page.DomContentEventFiredEvent):
+            self._on_content_load = event.timestamp
+        elif isinstance(event, page.LoadEventFiredEvent):
+            self._on_load = event.timestamp
+        else:
+            entry = self._entries.get(event.requestId)
+            if entry is None:
+                return
+            if isinstance(event, network.ResponseReceivedEvent):
+                entry['response'] = event.response
+            elif isinstance(event, network.LoadingFinishedEvent):
+                entry['finished'] = event.timestamp
+                entry['encodedDataLength'] = event.encodedDataLength
+            elif isinstance(event, network.LoadingFailedEvent):
+                entry['finished'] = event.timestamp
+                entry['error'] = event.errorText
+
+    def _on_request_will_be_sent(self, event: network.RequestWillBeSentEvent):
+        if self._started is None:
+            self._started = (event.wallTime, event.timestamp)
+
+        previous = self._entries.get(event.requestId)
+        if previous is not None and event.redirectResponse is not None:
+            # redirects reuse the request id, so move the finished hop out of the way
+            previous['response'] = event.redirectResponse
+            previous['finished'] = event.timestamp
+            previous['redirected'] = True
+            self._redirect_count += 1
+            self._entries['%s:redirect:%s' % (event.requestId, self._redirect_count)] = \
+                self._entries.pop(event.requestId)
+
+        if len(self._entries) >= self._max_entries:
+            self.dropped += 1
+            return
+
+        self._entries[event.requestId] = {
+            'requestId': event.requestId,
+            'request': event.request,
+            'wallTime': event.wallTime,
+            'timestamp': event.timestamp,
+            'response': None,
+            'finished': None,
+            'encodedDataLength': 0,
+            'error': None,
+            'redirected': False,
+            'body': None,
+        }
+
+    async def fetch_bodies(self, tab, budget_bytes: int = BODY_BUDGET_BYTES):
+        """
+        Fetch response bodies concurrently with `Network.getResponseBody` until `budget_bytes` is used up. Must be
+        called before the tab navigates away, as Chrome discards the bodies along with the document.
+        """
+        semaphore = asyncio.Semaphore(BODY_FETCH_CONCURRENCY)
+        used = 0
+
+        async def fetch(entry):
+            nonlocal used
+            async with semaphore:
+                if used >= budget_bytes:
+                    return
+                try:
+                    result = await tab.send_command(network.Network.getResponseBody(requestId=entry['requestId']))
+                except ChromewhipException as e:
+                    log.debug('Unable to fetch body for request %s: %s' % (entry['requestId'], e))
+                    return
+                ack = result['ack']['result']
+                if used + len(ack['body']) > budget_bytes:
+                    return
+                used += len(ack['body'])
+                entry['body'] = (ack['body'], ack['base64Encoded'])
+
+        await asyncio.gather(*[fetch(e) for e in self._entries.values()
+                               if e['response'] is not None and e['finished'] is not None
+                               and e['error'] is None and not e['redirected']])
+
+    def _entry_to_har(self, entry: dict) -> dict:
+        request = entry['request']
+        response = entry['response']
+        har_request = {
+            'method': request.method,
+            'url': request.url,
+            'httpVersion': response.protocol if response and response.protocol else '',
+            'cookies': [],
+            'headers': _name_values(request.headers.items()),
+            'queryString': _name_values(parse_qsl(urlsplit(request.url).query, keep_blank_values=True)),
+            'headersSize': -1,
+            'bodySize': len(request.postData) if request.postData else 0,
+        }
+        if request.postData:
+            har_request['postData'] = {
+                'mimeType': _header_value(request.headers, 'content-type'),
+                'text': request.postData,
+            }
+
+        content = {'size': 0, 'mimeType': 'x-unknown'}
+        har_response = {
+            'status': 0,
+            'statusText': '',
+            'httpVersion': '',
+            'cookies': [],
+            'headers': [],
+            'content': content,
+            'redirectURL': '',
+            'headersSize': -1,
+            'bodySize': -1,
+        }
+        timings = {'blocked': 0, 'dns': -1, 'connect': -1, 'ssl': -1, 'send': 0, 'wait': 0, 'receive': -1}
+        if response is not None:
+            har_response.update({
+                'status': response.status,
+                'statusText': response.statusText,
+                'httpVersion': response.protocol or '',
+                'headers': _name_values(response.headers.items()),
+                'redirectURL': _header_value(response.headers, 'location'),
+                'bodySize': entry['encodedDataLength'],
+            })
+            content['mimeType'] = response.mimeType
+            if response.timing:
+                timings = _timings(response.timing, entry['finished'])
+        if entry['body'] is not None:
+            body, is_base64 = entry['body']
+            content['size'] = len(body)
+            content['text'] = body
+            if is_base64:
+                content['encoding'] = 'base64'
+
+        har_entry = {
+            'pageref': PAGE_ID,
+            'startedDateTime': _iso_datetime(entry['wallTime']),
+            'time': sum(t for t in timings.values() if t > 0),
+            'request': har_request,
+            'response': har_response,
+            'cache': {},
+            'timings': timings,
+        }
+        if response is not None and response.remoteIPAddress:
+            har_entry['serverIPAddress'] = response.remoteIPAddress
+        if entry['error']:
+            har_entry['_errorText'] = entry['error']
+        return har_entry
+
+    def to_har(self, title: str = '') -> dict:
+        page_timings = {'onContentLoad': -1, 'onLoad': -1}
+        started = ''
+        if self._started is not None:
+            wall_time, timestamp = self._started
+            started = _iso_datetime(wall_time)
+            if self._on_content_load is not None:
+                page_timings['onContentLoad'] = (self._on_content_load - timestamp) * 1000
+            if self._on_load is not None:
+                page_timings['onLoad'] = (self._on_load - timestamp) * 1000
+
+        # redirect hops are re-keyed when the redirect is seen, so restore the order requests were sent in
+        entries = sorted(self._entries.values(), key=lambda e: e['timestamp'])
+        log_ = {
+            'version': HAR_VERSION,
+            'creator': {'name': 'chromewhip', 'version': _creator_version()},
+            'pages': [{
+                'startedDateTime': started,
+                'id': PAGE_ID,
+                'title': title,
+                'pageTimings': page_timings,
+            }],
+            'entries': [self._entry_to_har(e) for e in entries],
+        }
+        if self.dropped:
+            log_['comment'] = '%s requests were not recorded as the entry limit was reached' % self.dropped
+        return {'log': log_}
@@ -0,0 +1,226 @@
+""" Service metrics in the Prometheus text exposition format.
+
+Metrics only hold a handful of numbers per label set and are formatted on demand, so scraping costs next to nothing
+and no client library is needed.
+
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+import bisect
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# render phases range from a few milliseconds for a capture to the whole `wait` of a slow page
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# render phases in the order they happen, with the description given in `Server-Timing`
+RENDER_PHASES = OrderedDict([
+    ('queue', 'Waiting for a tab'),
+    ('setup', 'Device metrics setup'),
+    ('navigate', 'Navigation'),
+    ('wait', 'Wait'),
+    ('evaluate', 'JS profile evaluation'),
+    ('capture', 'Capture'),
+    ('encode', 'Encoding'),
+])
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (n, _escape(v)) for n, v in zip(names, values))
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        if any(m.name == metric.name for m in self._metrics):
+            raise ValueError('metric "%s" is already registered' % metric.name)
+        self._metrics.append(metric)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type_ = None
+
+    def __init__(self, name: str, documentation: str, labelnames: [str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._values = {}
+        if not self._labelnames:
+            # so that unlabelled metrics are exposed from the start
+            self._values[()] = self._initial_value()
+        registry.register(self)
+
+    def _initial_value(self):
+        return 0
+
+    def _key(self, labels: dict) -> tuple:
+        if len(labels) != len(self._labelnames) or set(labels) != set(self._labelnames):
+            raise ValueError('metric "%s" expects labels %s, got %s' % (self.name, self._labelnames, tuple(labels)))
+        return tuple(str(labels[n]) for n in self._labelnames)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> [str]:
+        return ['%s%s %s' % (self.name, _format_labels(self._labelnames, key), _format_value(value))
+                for key, value in sorted(self._values.items())]
+
+
+class Counter(_Metric):
+    type_ = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError('counters can only go up')
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_ = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_ = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: [str] = (), buckets=DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self._buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, documentation, labelnames=labelnames, registry=registry)
+
+    def _initial_value(self):
+        # per bucket counts, sum and count
+        return [[0] * len(self._buckets), 0.0, 0]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = self._initial_value()
+        state[0][bisect.bisect_left(self._buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def get(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe how long the block takes, even when it raises. """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def samples(self) -> [str]:
+        lines = []
+        bucket_labelnames = self._labelnames + ('le',)
+        for key, (counts, sum_, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self._buckets, counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %s' % (self.name,
+                                                 _format_labels(bucket_labelnames, key + (_format_value(bound),)),
+                                                 cumulative))
+            labels = _format_labels(self._labelnames, key)
+            lines.append('%s_sum%s %s' % (self.name, labels, _format_value(sum_)))
+            lines.append('%s_count%s %s' % (self.name, labels, count))
+        return lines
+
+
+def resident_memory_bytes(pid='self'):
+    """
+    :return: resident set size of a process, or None where `/proc` is not available
+    """
+    try:
+        with open('/proc/%s/statm' % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+RENDER_PHASE_SECONDS = Histogram('chromewhip_render_phase_seconds',
+                                 'Time spent in each phase of a render.', ['phase'])
+HTTP_REQUEST_SECONDS = Histogram('chromewhip_http_request_duration_seconds',
+                                 'Time taken to handle HTTP requests.', ['endpoint'])
+HTTP_REQUESTS = Counter('chromewhip_http_requests_total',
+                        'HTTP requests handled, by endpoint and status code.', ['endpoint', 'status'])
+CDP_ERRORS = Counter('chromewhip_cdp_errors_total',
+                     'DevTools commands that failed, by method and kind of error.', ['method', 'error'])
+CHROME_RESTARTS = Counter('chromewhip_chrome_restarts_total',
+                          'Times the Chrome process was respawned.')
+TAB_RECYCLES = Counter('chromewhip_tab_recycles_total',
+                       'Pooled tabs replaced by a fresh one, by reason.', ['reason'])
+POOL_TABS = Gauge('chromewhip_pool_tabs',
+                  'Tabs in the pool, by state.', ['state'])
+POOL_WAITING = Gauge('chromewhip_pool_waiting_renders',
+                     'Renders queued for a free tab.')
+RESIDENT_MEMORY = Gauge('chromewhip_resident_memory_bytes',
+                        'Resident memory of the service and of the main Chrome process.', ['process'])
+
+
+class Timings:
+    """ Durations of the phases of a single render, each also observed in `RENDER_PHASE_SECONDS`. """
+
+    def __init__(self):
+        self._durations = OrderedDict()
+
+    def record(self, phase: str, seconds: float):
+        if phase not in RENDER_PHASES:
+            raise ValueError('unknown render phase "%s"' % phase)
+        # phases like capture can happen more than once per render, e.g. for tiles
+        self._durations[phase] = self._durations.get(phase, 0) + seconds
+        RENDER_PHASE_SECONDS.observe(seconds, phase=phase)
+
+    @contextmanager
+    def phase(self, phase: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(phase, time.monotonic() - started)
+
+    def to_dict(self) -> {str: float}:
+        """
+        :return: milliseconds spent in each phase, in the order phases happen
+        """
+        return OrderedDict((p, round(self._durations[p] * 1000, 3)) for p in RENDER_PHASES if p in self._durations)
+
+    def server_timing(self) -> str:
+        """ Format as a `Server-Timing` header value, see https://www.w3.org/TR/server-timing/ """
+        return ', '.join('%s;desc="%s";dur=%s' % (p, RENDER_PHASES[p], ms) for p, ms in self.to_dict().items())
@@ -4,6 +4,7 @@ import pprint
 
 from aiohttp import web
 
+from chromewhip import metrics
 from chromewhip.chrome import ChromewhipException
 
 
@@ -29,3 +30,22 @@ async def error_middleware(app, handler):
             verbose_tb = traceback.format_exc()
             return json_error(verbose_tb)
     return middleware_handler
+
+
+async def metrics_middleware(app, handler):
+    async def middleware_handler(request):
+        # label by route rather than path, so arbitrary 404 paths can't blow up the number of series
+        resource = request.match_info.route.resource
+        endpoint = resource.canonical if resource else 'unmatched'
+        status = 500
+        try:
+            with metrics.HTTP_REQUEST_SECONDS.time(endpoint=endpoint):
+                response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as ex:
+            status = ex.status
+            raise
+        finally:
+            metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+    return middleware_handler
@@ -0,0 +1,57 @@
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+BYTES_PER_PIXEL = 3  # 8-bit RGB
+
+
+def _chunk(type_: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(type_ + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + type_ + data + struct.pack('>I', crc)
+
+
+class PNGStreamWriter:
+    """ Encodes an 8-bit RGB image into PNG incrementally.
+
+    Rows are compressed as they are fed in and the encoded bytes are returned straight away, so the
+    caller can write them out without ever holding the full image in memory.
+    """
+    def __init__(self, width: int, height: int, compression_level: int = 6):
+        self._width = width
+        self._height = height
+        self._row_size = width * BYTES_PER_PIXEL
+        self._rows_written = 0
+        self._compressor = zlib.compressobj(compression_level)
+
+    @property
+    def rows_written(self):
+        return self._rows_written
+
+    def header(self) -> bytes:
+        ihdr = struct.pack('>IIBBBBB', self._width, self._height, 8, 2, 0, 0, 0)
+        return PNG_SIGNATURE + _chunk(b'IHDR', ihdr)
+
+    def write_rows(self, raw: bytes) -> bytes:
+        """
+        :param raw: packed RGB pixel data for one or more complete rows
+        :return: encoded bytes ready to be written out, may be empty
+        """
+        if len(raw) % self._row_size:
+            raise ValueError('raw data of %s bytes is not a whole number of %s byte rows' % (len(raw), self._row_size))
+        num_rows = len(raw) // self._row_size
+        if self._rows_written + num_rows > self._height:
+            raise ValueError('writing %s rows would exceed image height of %s' % (num_rows, self._height))
+
+        output = []
+        for i in range(num_rows):
+            start = i * self._row_size
+            output.append(self._compressor.compress(b'\x00' + raw[start:start + self._row_size]))
+        self._rows_written += num_rows
+
+        data = b''.join(output)
+        return _chunk(b'IDAT', data) if data else b''
+
+    def finish(self) -> bytes:
+        if self._rows_written != self._height:
+            raise ValueError('only %s of %s rows were written' % (self._rows_written, self._height))
+        return _chunk(b'IDAT', self._compressor.flush()) + _chunk(b'IEND', b'')
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from chromewhip import metrics
+from chromewhip.chrome import ChromewhipException, TabCrashedError
+from chromewhip.protocol import runtime
+
+# how long an incognito tab waits before trying again to open its replacement
+REPLACE_RETRY_S = 1
+
+log = logging.getLogger('chromewhip.pool')
+
+
+class TabPool:
+    """ Hands each tab of a `Chrome` to a single render at a time.
+
+    Renders beyond the number of tabs wait in FIFO order for a tab to be released, so a tab never has two
+    navigations racing on it. Tabs are recycled once they served `max_renders` renders, lived for `max_age_s` or
+    their JS heap grew past `max_heap_bytes`. A recycled tab keeps serving renders until its replacement is open,
+    so recycling never shrinks the pool.
+
+    With `incognito`, every tab is opened in a browser context of its own and is only ever handed to one render,
+    then disposed of and replaced in the background, so no cookies, storage or cache leak between renders.
+    """
+    def __init__(self, chrome, size: int, max_renders: int = None, max_age_s: float = None,
+                 max_heap_bytes: int = None, incognito: bool = False):
+        if size < 1:
+            raise ValueError('pool size must be at least 1')
+        self._chrome = chrome
+        self._size = size
+        self._max_renders = max_renders
+        self._max_age_s = max_age_s
+        self._max_heap_bytes = max_heap_bytes
+        self._incognito = incognito
+        self._tabs = []
+        self._idle = None
+        self._in_use = set()
+        self._renders = {}
+        self._opened_at = {}
+        self._replacing = set()
+        self._tasks = set()
+        self._starting = None
+        self._waiting = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def in_use(self) -> int:
+        return len(self._in_use)
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def tabs(self) -> tuple:
+        return tuple(self._tabs)
+
+    @property
+    def idle_tabs(self) -> tuple:
+        """ Tabs not held by a render, which have nothing to keep them from answering straight away. """
+        return tuple(t for t in self._tabs if t not in self._in_use)
+
+    async def start(self):
+        """ Connect to Chrome and open tabs up to the pool size, only once no matter how many callers race here. """
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._open_tabs())
+        try:
+            await asyncio.shield(self._starting)
+        except Exception:
+            # let the next render retry, e.g. when Chrome was still starting up
+            self._starting = None
+            raise
+
+    async def _open_tabs(self):
+        await self._chrome.connect()
+        # the tabs Chrome started with all share the default context
+        tabs = [] if self._incognito else list(self._chrome.tabs)[:self._size]
+        while len(tabs) < self._size:
+            tabs.append(await self._create_tab())
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        for tab in tabs:
+            self._add(tab)
+        log.debug('Started pool of %s tabs' % len(tabs))
+
+    async def _create_tab(self):
+        if self._incognito:
+            return await self._chrome.create_tab(incognito=True)
+        return await self._chrome.create_tab()
+
+    def _add(self, tab):
+        self._tabs.append(tab)
+        self._renders[tab] = 0
+        self._opened_at[tab] = time.monotonic()
+        self._idle.put_nowait(tab)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @asynccontextmanager
+    async def tab(self):
+        """ Wait for an idle tab and hold it for the duration of the block. """
+        await self.start()
+        self._waiting += 1
+        try:
+            while True:
+                tab = await self._idle.get()
+                # tabs retired or crashed while idle are left in the queue rather than searched for
+                if tab not in self._renders:
+                    continue
+                if tab.is_alive:
+                    break
+                self.replace(tab, 'crashed')
+        finally:
+            self._waiting -= 1
+        self._in_use.add(tab)
+        try:
+            yield tab
+        finally:
+            # checking the heap takes a round trip, which shouldn't hold up the response
+            self._spawn(self._release(tab))
+
+    async def _release(self, tab):
+        try:
+            if tab in self._renders:
+                self._renders[tab] += 1
+                if self._incognito:
+                    self._retire(tab)
+                elif tab not in self._replacing:
+                    reason = await self._recycle_reason(tab)
+                    if reason:
+                        self.replace(tab, reason)
+        finally:
+            self._in_use.discard(tab)
+        if tab not in self._renders:
+            # replaced while in use
+            await self._close(tab)
+        elif not self._incognito:
+            self._idle.put_nowait(tab)
+
+    def replace(self, tab, reason: str):
+        """ Open a new tab in the background to take the place of `tab`, which is closed once it is idle. """
+        if tab not in self._renders or tab in self._replacing:
+            return
+        log.info('Recycling tab %s, reason: %s' % (tab.id_, reason))
+        metrics.TAB_RECYCLES.inc(reason=reason)
+        self._retire(tab)
+
+    def _retire(self, tab):
+        if tab not in self._renders or tab in self._replacing:
+            return
+        self._replacing.add(tab)
+        self._spawn(self._replace(tab))
+
+    async def restart(self):
+        """
+        Open a whole new set of tabs, once the browser was respawned. Renders waiting for a tab keep waiting, and
+        those holding one of the old tabs fail.
+        """
+        for tab in self._tabs:
+            tab.fail(TabCrashedError('Tab %s was lost with the browser' % tab.id_))
+        self._tabs = []
+        self._renders = {}
+        self._opened_at = {}
+        self._replacing = set()
+        self._starting = None
+        await self.start()
+
+    async def _recycle_reason(self, tab):
+        if not tab.is_alive:
+            return 'crashed'
+        if self._max_renders and self._renders[tab] >= self._max_renders:
+            return 'renders'
+        if self._max_age_s and time.monotonic() - self._opened_at[tab] >= self._max_age_s:
+            return 'age'
+        if self._max_heap_bytes:
+            try:
+                result = await tab.send_command(runtime.Runtime.getHeapUsage())
+            except ChromewhipException as e:
+                log.warning('Unable to get heap usage of tab %s: %s' % (tab.id_, e))
+                return None
+            if result['ack']['result']['usedSize'] >= self._max_heap_bytes:
+                return 'heap'
+        return None
+
+    async def _replace(self, tab):
+        while True:
+            try:
+                replacement = await self._create_tab()
+                break
+            except Exception as e:
+                log.error('Unable to open a replacement for tab %s: %s' % (tab.id_, e))
+                if not self._incognito:
+                    # keep the old tab going, and try again after its next render
+                    self._replacing.discard(tab)
+                    return
+            # a used incognito tab must never be handed out again
+            await asyncio.sleep(REPLACE_RETRY_S)
+            if tab not in self._renders:
+                return
+
+        if tab not in self._renders:
+            # the pool restarted meanwhile
+            await self._close(replacement)
+            return
+
+        self._tabs.remove(tab)
+        del self._renders[tab]
+        del self._opened_at[tab]
+        self._replacing.discard(tab)
+        self._add(replacement)
+        # otherwise the release closes it once the render holding it is done
+        if tab not in self._in_use:
+            await self._close(tab)
+
+    async def _close(self, tab):
+        try:
+            await self._chrome.close_tab(tab)
+        except Exception as e:
+            log.warning('Unable to close recycled tab %s: %s' % (tab.id_, e))
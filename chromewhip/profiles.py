@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+
+# how often the profiles folder is checked for changes
+POLL_INTERVAL_S = 2
+
+log = logging.getLogger('chromewhip.profiles')
+
+
+def _js_files(path: str) -> [str]:
+    return sorted(e.name for e in os.scandir(path) if e.is_file() and os.path.splitext(e.name)[1] == '.js')
+
+
+class JSProfile:
+    """ The JavaScript of a named profile, made of every `.js` file of its folder in name order. """
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+
+    @property
+    def source_url(self) -> str:
+        # names the script in devtools and in stack traces of errors it throws
+        return 'chromewhip://profiles/%s.js' % self.name
+
+    @classmethod
+    def from_directory(cls, path: str) -> 'JSProfile':
+        name = os.path.basename(os.path.normpath(path))
+        sources = []
+        for fn in _js_files(path):
+            with open(os.path.join(path, fn)) as f:
+                sources.append('{}\n'.format(f.read()))
+        log.debug('adding profile "{}"'.format(name))
+        return cls(name, ''.join(sources))
+
+
+class ProfileRegistry:
+    """ Every subfolder of `path` as a named profile, reloaded whenever its files change.
+
+    Updates are swapped in as a whole new mapping, and profiles are never modified once loaded, so a render that
+    looked up a profile keeps running that version. For compatibility, `.js` files directly in `path` make up a
+    profile named after the folder itself.
+    """
+    def __init__(self, path: str):
+        self._path = path
+        self._profiles = {}
+        self._signature = None
+
+    def __contains__(self, name):
+        return name in self._profiles
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, name: str, default=None):
+        return self._profiles.get(name, default)
+
+    def _scan(self) -> tuple:
+        """
+        :return: the modification time and size of every profile file, which changes whenever a profile does
+        """
+        directories = [self._path] + sorted(e.path for e in os.scandir(self._path) if e.is_dir())
+        signature = []
+        for directory in directories:
+            for fn in _js_files(directory):
+                stat = os.stat(os.path.join(directory, fn))
+                signature.append((directory, fn, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self) -> bool:
+        """
+        Load the profiles again if any of their files changed since the last call.
+
+        :return: whether profiles were swapped
+        """
+        signature = self._scan()
+        if signature == self._signature:
+            return False
+
+        profiles = {}
+        for directory in sorted({d for d, *_ in signature}):
+            profile = JSProfile.from_directory(directory)
+            previous = self._profiles.get(profile.name)
+            # keep unchanged profiles as they were, so tabs still recognise their compiled scripts
+            profiles[profile.name] = previous if previous and previous.source == profile.source else profile
+
+        self._profiles = profiles
+        self._signature = signature
+        log.info('loaded profiles %s' % ', '.join('"%s"' % n for n in sorted(profiles)))
+        return True
+
+    async def watch(self, interval_s: float = POLL_INTERVAL_S):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval_s)
+            try:
+                await loop.run_in_executor(None, self.reload)
+            except OSError as e:
+                # e.g. a file removed while scanning, keep the current profiles until the next check
+                log.warning('Unable to reload profiles from "%s": %s' % (self._path, e))
@@ -1,6 +1,15 @@
-from chromewhip.views import render_html, render_png
+from chromewhip.views import render_html, render_png, render_jpeg, render_webp, render_pdf, render_json, \
+    render_har, render_batch, render_screencast, expose_metrics
 
 
 def setup_routes(app):
     app.router.add_get('/render.html', render_html)
     app.router.add_get('/render.png', render_png)
+    app.router.add_get('/render.jpeg', render_jpeg)
+    app.router.add_get('/render.webp', render_webp)
+    app.router.add_get('/render.pdf', render_pdf)
+    app.router.add_get('/render.json', render_json)
+    app.router.add_get('/render.har', render_har)
+    app.router.add_post('/render.batch', render_batch)
+    app.router.add_get('/screencast', render_screencast)
+    app.router.add_get('/metrics', expose_metrics)
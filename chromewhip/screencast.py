@@ -0,0 +1,82 @@
+import asyncio
+import base64
+import logging
+from collections import deque
+
+from chromewhip.chrome import ChromewhipException
+from chromewhip.protocol import page
+
+# frames held for a viewer, beyond which the oldest is dropped
+MAX_BUFFERED_FRAMES = 2
+MAX_FPS = 30
+MAX_FRAME_DIMENSION_PX = 1920
+DEFAULT_FPS = 10
+DEFAULT_QUALITY = 60
+
+log = logging.getLogger('chromewhip.screencast')
+
+
+class Screencast:
+    """ Streams JPEG frames of a tab from `Page.startScreencast`, at the pace of whoever reads them.
+
+    Chrome only sends another frame once the last one was acknowledged, so each frame is acknowledged after it has
+    been read and `max_fps` is up, throttling Chrome to the reader. Frames that still arrive while the reader is
+    behind replace the oldest buffered one, so no more than `MAX_BUFFERED_FRAMES` are ever held.
+    """
+    def __init__(self, max_width: int, max_height: int, quality: int = DEFAULT_QUALITY, max_fps: float = DEFAULT_FPS):
+        if not 0 < max_width <= MAX_FRAME_DIMENSION_PX or not 0 < max_height <= MAX_FRAME_DIMENSION_PX:
+            raise ValueError('screencast frames must be between 1 and %spx wide and high' % MAX_FRAME_DIMENSION_PX)
+        if not 0 <= quality <= 100:
+            raise ValueError('quality must be between 0 and 100')
+        if not 0 < max_fps <= MAX_FPS:
+            raise ValueError('max_fps must be greater than 0 and at most %s' % MAX_FPS)
+        self._max_width = max_width
+        self._max_height = max_height
+        self._quality = quality
+        self._max_fps = max_fps
+        self._tab = None
+        self._frames = deque()
+        self._frame_ready = asyncio.Event()
+
+    async def attach(self, tab):
+        self._tab = tab
+        tab.add_event_listener(page.ScreencastFrameEvent, self.on_frame)
+        await tab.send_command(page.Page.startScreencast(format='jpeg', quality=self._quality,
+                                                         maxWidth=self._max_width, maxHeight=self._max_height))
+
+    async def detach(self, tab):
+        tab.remove_event_listener(page.ScreencastFrameEvent, self.on_frame)
+        self._frames.clear()
+        try:
+            await tab.send_command(page.Page.stopScreencast())
+        except ChromewhipException as e:
+            log.warning('Unable to stop screencast of tab %s: %s' % (tab.id_, e))
+
+    def on_frame(self, event: page.ScreencastFrameEvent):
+        if len(self._frames) >= MAX_BUFFERED_FRAMES:
+            dropped = self._frames.popleft()
+            asyncio.ensure_future(self._ack(dropped))
+        self._frames.append(event)
+        self._frame_ready.set()
+
+    async def _ack(self, event: page.ScreencastFrameEvent):
+        try:
+            await self._tab.send_command(page.Page.screencastFrameAck(event.sessionId))
+        except ChromewhipException as e:
+            log.debug('Unable to acknowledge screencast frame %s: %s' % (event.sessionId, e))
+
+    async def frames(self):
+        """
+        :return: async iterator of JPEG frames, the next of which is only requested once the last was consumed
+        """
+        loop = asyncio.get_event_loop()
+        interval_s = 1 / self._max_fps
+        while True:
+            while not self._frames:
+                self._frame_ready.clear()
+                await self._frame_ready.wait()
+            event = self._frames.popleft()
+            started = loop.time()
+            yield base64.b64decode(event.data)
+            await asyncio.sleep(max(0, interval_s - (loop.time() - started)))
+            await self._ack(event)
@@ -0,0 +1,231 @@
+import abc
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sys
+from typing import Optional
+
+import websockets
+import websockets.exceptions
+import websockets.protocol
+
+from chromewhip import helpers
+
+# the fds Chrome reads commands from and writes messages to with `--remote-debugging-pipe`
+PIPE_COMMANDS_FD = 3
+PIPE_MESSAGES_FD = 4
+# messages over the pipe aren't framed, but a single message still has to fit in the read buffer
+PIPE_MAX_MESSAGE_BYTES = 2 ** 28
+
+log = logging.getLogger('chromewhip.transport')
+
+
+class TransportClosed(Exception):
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+class Transport(abc.ABC):
+    """ A connection to a devtools target, sending and receiving protocol messages as dicts. """
+
+    @property
+    def close_code(self) -> Optional[int]:
+        """ Why the connection closed, None while it is open or when the transport has no close codes. """
+        return None
+
+    @abc.abstractmethod
+    async def send(self, message: dict):
+        pass
+
+    @abc.abstractmethod
+    async def recv(self) -> Optional[dict]:
+        """ The next message, raising `TransportClosed` once the connection closed. """
+
+    @abc.abstractmethod
+    async def close(self):
+        pass
+
+
+class WebSocketTransport(Transport):
+    """ A target's own websocket, as listed by Chrome's `/json` HTTP endpoint. """
+
+    def __init__(self, ws: websockets.WebSocketClientProtocol):
+        self._ws = ws
+
+    @classmethod
+    async def connect(cls, ws_uri: str, max_size: int) -> 'WebSocketTransport':
+        return cls(await websockets.connect(ws_uri, max_size=max_size))
+
+    @property
+    def close_code(self):
+        if self._ws.state == websockets.protocol.State.OPEN:
+            return None
+        return self._ws.close_code
+
+    async def send(self, message):
+        try:
+            await self._ws.send(json.dumps(message, cls=helpers.ChromewhipJSONEncoder))
+        except websockets.exceptions.ConnectionClosed as e:
+            raise TransportClosed(str(e), e.code) from e
+
+    async def recv(self):
+        try:
+            data = await self._ws.recv()
+        except websockets.exceptions.ConnectionClosed as e:
+            raise TransportClosed(str(e), e.code) from e
+        if not data:
+            return None
+        return json.loads(data)
+
+    async def close(self):
+        await self._ws.close()
+
+
+class PipeConnection:
+    """ The browser end of `--remote-debugging-pipe`: null-delimited JSON over a pair of fds inherited by Chrome.
+
+    There is no framing or masking to pay for and no port to take, but there is a single connection for the whole
+    browser, so tabs attach to it with flat sessions, told apart by the `sessionId` of every message.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 read_transport: asyncio.ReadTransport = None):
+        self._reader = reader
+        self._writer = writer
+        self._read_transport = read_transport
+        self._sessions = {}
+        self._closed = None
+        self._recv_task = asyncio.ensure_future(self._recv_handler())
+
+    @classmethod
+    async def open(cls, read_fd: int, write_fd: int) -> 'PipeConnection':
+        loop = asyncio.get_event_loop()
+        reader = asyncio.StreamReader(limit=PIPE_MAX_MESSAGE_BYTES)
+        read_transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                         os.fdopen(read_fd, 'rb', 0))
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                            os.fdopen(write_fd, 'wb', 0))
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        return cls(reader, writer, read_transport)
+
+    def session(self, session_id: str = None) -> 'PipeSession':
+        """ The transport of an attached session, or of the browser itself without `session_id`. """
+        return PipeSession(self, session_id)
+
+    async def _recv_handler(self):
+        try:
+            while True:
+                data = await self._reader.readuntil(b'\0')
+                message = json.loads(data[:-1])
+                queue = self._sessions.get(message.get('sessionId'))
+                if queue is None:
+                    log.debug('Ignoring message for detached session %s' % message.get('sessionId'))
+                    continue
+                queue.put_nowait(message)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self._close(TransportClosed('Chrome closed the pipe: %s' % e))
+        except asyncio.LimitOverrunError:
+            self._close(TransportClosed('Message from Chrome exceeded %s bytes' % PIPE_MAX_MESSAGE_BYTES))
+        except ValueError as e:
+            # not JSON, so there is no telling where the next message starts
+            self._close(TransportClosed('Invalid message from Chrome: %s' % e))
+        except asyncio.CancelledError:
+            self._close(TransportClosed('Pipe closed'))
+
+    def _close(self, error: TransportClosed):
+        self._closed = error
+        for queue in self._sessions.values():
+            # wakes up every session waiting on a message
+            queue.put_nowait(None)
+
+    async def _send(self, message: dict):
+        if self._closed:
+            raise self._closed
+        self._writer.write(json.dumps(message, cls=helpers.ChromewhipJSONEncoder).encode() + b'\0')
+        await self._writer.drain()
+
+    async def close(self):
+        self._recv_task.cancel()
+        await asyncio.gather(self._recv_task, return_exceptions=True)
+        # whichever way the connection ended, both pipes are only closed here
+        self._writer.close()
+        if self._read_transport:
+            self._read_transport.close()
+
+
+class PipeSession(Transport):
+
+    def __init__(self, connection: PipeConnection, session_id: str = None):
+        self._connection = connection
+        self._session_id = session_id
+        self._queue = asyncio.Queue()
+        connection._sessions[session_id] = self._queue
+        if connection._closed:
+            self._queue.put_nowait(None)
+
+    async def send(self, message):
+        if self._session_id:
+            message['sessionId'] = self._session_id
+        await self._connection._send(message)
+
+    async def recv(self):
+        message = await self._queue.get()
+        if message is None:
+            raise self._connection._closed
+        return message
+
+    async def close(self):
+        # the target detaches the session itself when it is closed
+        if self._connection._sessions.get(self._session_id) is self._queue:
+            del self._connection._sessions[self._session_id]
+
+
+def _inheritable_pipe_ends():
+    """ Pipes for Chrome's end to be moved to fds 3 and 4 in the child, out of the way of both those fds. """
+    commands_read, commands_write = os.pipe()
+    messages_read, messages_write = os.pipe()
+    child_fds = []
+    for fd in (commands_read, messages_write):
+        high_fd = fcntl.fcntl(fd, fcntl.F_DUPFD, PIPE_MESSAGES_FD + 1)
+        os.set_inheritable(high_fd, False)
+        os.close(fd)
+        child_fds.append(high_fd)
+    return child_fds, commands_write, messages_read
+
+
+# `subprocess` only passes fds on under their own numbers, so Chrome is exec'd from a python that moves them first
+_EXEC_WITH_PIPE = '; '.join([
+    'import os, sys',
+    'commands, messages = int(sys.argv[1]), int(sys.argv[2])',
+    'os.dup2(commands, %d)' % PIPE_COMMANDS_FD,
+    'os.dup2(messages, %d)' % PIPE_MESSAGES_FD,
+    'os.close(commands)',
+    'os.close(messages)',
+    'os.execvp(sys.argv[3], sys.argv[3:])',
+])
+
+
+async def launch_with_pipe(args: [str], env: dict = None, loop: asyncio.AbstractEventLoop = None):
+    """
+    Start Chrome with `--remote-debugging-pipe` added to `args`.
+
+    :return: the Chrome process and the `PipeConnection` to it
+    """
+    (commands_read, messages_write), commands_write, messages_read = _inheritable_pipe_ends()
+    wrapper = [sys.executable, '-I', '-S', '-c', _EXEC_WITH_PIPE, str(commands_read), str(messages_write)]
+    try:
+        # every other fd of ours is closed in the child
+        process = await asyncio.subprocess.create_subprocess_exec(*wrapper, *args, '--remote-debugging-pipe',
+                                                                  env=env, loop=loop,
+                                                                  pass_fds=(commands_read, messages_write))
+    except Exception:
+        os.close(commands_write)
+        os.close(messages_read)
+        raise
+    finally:
+        os.close(commands_read)
+        os.close(messages_write)
+    return process, await PipeConnection.open(messages_read, commands_write)
@@ -1,110 +1,656 @@
 import asyncio
+import base64
 import functools
+import json
 import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from io import BytesIO
+from typing import Optional
 
 from bs4 import BeautifulSoup
 from aiohttp import web
+from PIL import Image
 
+from chromewhip import blocking, har, metrics, png, screencast, waiting
+from chromewhip.chrome import ChromewhipException, ProtocolError
 from chromewhip.protocol import page, emulation, browser, dom, runtime
 
 BS = functools.partial(BeautifulSoup, features="lxml")
 
+# pages taller than this exceed payload and GPU texture limits when captured in one go
+TILED_CAPTURE_THRESHOLD_PX = 30000
+TILE_HEIGHT_PX = 4096
+
+HTML_CHUNK_SIZE = 2 ** 16
+
+LOSSY_FORMATS = ('jpeg', 'webp')
+DEFAULT_QUALITY = 75
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# width and height in inches, the unit `Page.printToPDF` takes
+PAPER_SIZES = {
+    'letter': (8.5, 11),
+    'legal': (8.5, 14),
+    'tabloid': (11, 17),
+    'a3': (11.69, 16.54),
+    'a4': (8.27, 11.69),
+    'a5': (5.83, 8.27),
+}
+PDF_MARGINS = ('top', 'right', 'bottom', 'left')
+
+MJPEG_BOUNDARY = b'frame'
+SCREENCAST_DEFAULT_DURATION_S = 60
+# a screencast holds a pooled tab for its whole duration
+SCREENCAST_MAX_DURATION_S = 600
+
 log = logging.getLogger('chromewhip.views')
 
-async def _go(request: web.Request):
 
-    js_profiles = request.app['js-profiles']
-    c = request.app['chrome-driver']
+def _parse_viewport(query) -> (int, int):
+    raw_viewport = query.get('viewport', '1024x768')
+    parts = raw_viewport.split('x')
+    return int(parts[0]), int(parts[1])
+
+
+@asynccontextmanager
+async def _go(app: web.Application, query, timings: metrics.Timings,
+              har_collector: Optional[har.HarCollector] = None, cast: Optional[screencast.Screencast] = None):
+    """
+    Navigate a pooled tab according to the render `query` params and yield it, undoing any per-render
+    interception of the tab on exit. Each phase of the render is recorded in `timings`.
+    """
+    js_profiles = app['js-profiles']
 
-    url = request.query.get('url')
+    url = query.get('url')
     if not url:
-        return web.HTTPBadRequest(reason='no url query param provided')  # TODO: match splash reply
+        raise web.HTTPBadRequest(reason='no url query param provided')  # TODO: match splash reply
 
-    wait_s = float(request.query.get('wait', 0))
+    wait_s = float(query.get('wait', 0))
 
-    raw_viewport = request.query.get('viewport', '1024x768')
-    parts = raw_viewport.split('x')
-    width = int(parts[0])
-    height = int(parts[1])
+    width, height = _parse_viewport(query)
 
-    js_profile_name = request.query.get('js', None)
+    js_profile_name = query.get('js', None)
+    profile = None
     if js_profile_name:
         profile = js_profiles.get(js_profile_name)
         if not profile:
-            return web.HTTPBadRequest(reason='profile name is incorrect')  # TODO: match splash
+            raise web.HTTPBadRequest(reason='profile name is incorrect')  # TODO: match splash
+    # injected profiles run before the page's own scripts, saving a round trip after load
+    should_inject_profile = query.get('js_inject') == '1'
 
     # TODO: potentially validate and verify js source for errors and security concerrns
-    js_source = request.query.get('js_source', None)
-
-    await c.connect()
-    tab = c.tabs[0]
-    cmd = page.Page.setDeviceMetricsOverride(width=width,
-                                             height=height,
-                                             deviceScaleFactor=0.0,
-                                             mobile=False)
-    await tab.send_command(cmd)
-    await tab.enable_page_events()
-    await tab.go(url)
-    await asyncio.sleep(wait_s)
-    if js_profile_name:
-        await tab.evaluate(js_profiles[js_profile_name])
+    js_source = query.get('js_source', None)
+
+    wait_until = query.get('wait_until')
+    virtual_time_budget = query.get('virtual_time_budget')
+    if wait_until and virtual_time_budget:
+        raise web.HTTPBadRequest(reason='wait_until and virtual_time_budget can not be used together')
+    try:
+        blocker = blocking.RequestBlocker.from_query(query, filters=app['filters'])
+        if virtual_time_budget:
+            waiter = waiting.VirtualTimeWaiter(float(virtual_time_budget))
+        elif wait_until:
+            waiter = waiting.PageSettledWaiter(wait_until)
+        else:
+            waiter = None
+    except ValueError as e:
+        raise web.HTTPBadRequest(reason=str(e))
 
-    if js_source:
-        await tab.evaluate(js_source)
+    queued = time.monotonic()
+    async with app['tab-pool'].tab() as tab:
+        timings.record('queue', time.monotonic() - queued)
+        # interception has to be in place before navigation to see the document request
+        interceptors = [i for i in (har_collector, blocker, waiter, cast) if i]
+        attached = []
+        is_page_enabled = False
+        try:
+            with timings.phase('setup'):
+                await tab.set_device_metrics(width, height)
+                await tab.enable('Page')
+                is_page_enabled = True
+                # pooled tabs keep injected scripts between renders, so this also drops those of the last render
+                await tab.set_injected_scripts([profile.source] if profile and should_inject_profile else [])
+                for interceptor in interceptors:
+                    await interceptor.attach(tab)
+                    attached.append(interceptor)
 
-    return tab
+            if waiter:
+                # `wait` becomes an upper bound, rather than a fixed delay
+                with timings.phase('navigate'):
+                    res = await tab.send_command(page.Page.navigate(url))
+                error_text = res['ack']['result'].get('errorText')
+                if error_text:
+                    # the waiter would otherwise sit out its timeout on a document that never loads
+                    raise web.HTTPBadGateway(reason='Navigation to %s failed: %s' % (url, error_text))
+                loader_id = res['ack']['result'].get('loaderId')
+                with timings.phase('wait'):
+                    await waiter.wait(loader_id, timeout=wait_s or waiting.DEFAULT_TIMEOUT_S)
+            else:
+                with timings.phase('navigate'):
+                    await tab.go(url)
+                with timings.phase('wait'):
+                    await asyncio.sleep(wait_s)
+
+            with timings.phase('evaluate'):
+                if profile and not should_inject_profile:
+                    await tab.run_script(profile.source, source_url=profile.source_url)
+                if js_source:
+                    await tab.evaluate(js_source)
+
+            yield tab
+        finally:
+            for interceptor in reversed(attached):
+                await _undo(interceptor.detach(tab), 'detach %s from tab %s' % (type(interceptor).__name__, tab.id_))
+            if is_page_enabled:
+                await _undo(tab.disable('Page'), 'disable Page on tab %s' % tab.id_)
+
+
+async def _undo(coro, what: str):
+    """
+    Await a step undoing the setup of a render, logging its failure rather than raising it, so the remaining steps
+    still run and the render's own exception isn't replaced
+    """
+    try:
+        await coro
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception('Unable to %s' % what)
+
+
+def _with_timings(resp: web.StreamResponse, timings: metrics.Timings) -> web.StreamResponse:
+    resp.headers['Server-Timing'] = timings.server_timing()
+    return resp
+
+
+def _prettify(html: bytes) -> str:
+    return BS(html.decode()).prettify()
 
 
 async def render_html(request: web.Request):
     # https://splash.readthedocs.io/en/stable/api.html#render-html
-    tab = await _go(request)
-    return web.Response(text=BS((await tab.html()).decode()).prettify())
+    timings = metrics.Timings()
+    async with _go(request.app, request.query, timings) as tab:
+        with timings.phase('capture'):
+            html = await tab.html()
+
+    if request.query.get('prettify') == '1':
+        # parsing a large document takes longer than the render itself, so keep it off the event loop
+        with timings.phase('encode'):
+            text = await asyncio.get_event_loop().run_in_executor(None, _prettify, html)
+        return _with_timings(web.Response(text=text, content_type='text/html'), timings)
+
+    resp = _with_timings(web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'}), timings)
+    resp.content_length = len(html)
+    await resp.prepare(request)
+    for offset in range(0, len(html), HTML_CHUNK_SIZE):
+        await resp.write(html[offset:offset + HTML_CHUNK_SIZE])
+    await resp.write_eof()
+    return resp
+
+
+async def _content_height(tab) -> int:
+    res = await tab.send_command(page.Page.getLayoutMetrics())
+    full_height = math.ceil(res['ack']['result']['contentSize'].height)
+    log.debug('full_height = %s' % full_height)
+    return full_height
+
+
+async def _full_page_screenshot(tab, timings: metrics.Timings, width: int, full_height: int, format_: str = 'png',
+                                quality: int = None, scale: float = 1):
+    """
+    Capture the whole page with a single `Page.captureScreenshot`, by enlarging the device metrics
+    to the page's content size and clipping to it.
+    """
+    await tab.set_device_metrics(width, full_height)
+    clip = page.Viewport(x=0, y=0, width=width, height=full_height, scale=scale)
+    with timings.phase('capture'):
+        return await tab.screenshot(format_=format_, quality=quality, clip=clip)
+
+
+def _encode_tile(writer: png.PNGStreamWriter, data: bytes, width: int, height: int):
+    tile = Image.open(BytesIO(data)).convert('RGB')
+    if tile.size != (width, height):
+        tile = tile.crop((0, 0, width, height))
+    return writer.write_rows(tile.tobytes())
+
+
+async def _tiled_screenshot(request: web.Request, tab, timings: metrics.Timings, width: int, full_height: int,
+                            scale: float = 1):
+    """
+    Capture the whole page as fixed height tiles, encoding each into a PNG that is streamed to the client
+    as it is built, so that only a single tile is ever held in memory. Headers go out before the first tile,
+    so `Server-Timing` leaves out the capture and encoding of tiles.
+    """
+    await tab.set_device_metrics(width, TILE_HEIGHT_PX)
+
+    output_width = round(width * scale)
+    writer = png.PNGStreamWriter(output_width, round(full_height * scale))
+    resp = _with_timings(web.StreamResponse(headers={'Content-Type': 'image/png'}), timings)
+    await resp.prepare(request)
+    await resp.write(writer.header())
+
+    loop = asyncio.get_event_loop()
+    offset = 0
+    while offset < full_height:
+        tile_height = min(TILE_HEIGHT_PX, full_height - offset)
+        # derive output rows from the absolute offsets so rounding never drifts from the total height
+        output_tile_height = round((offset + tile_height) * scale) - round(offset * scale)
+        clip = page.Viewport(x=0, y=offset, width=width, height=tile_height, scale=scale)
+        with timings.phase('capture'):
+            data = await tab.screenshot(clip=clip)
+        # decoding and compressing is CPU bound, so keep it off the event loop
+        with timings.phase('encode'):
+            encoded = await loop.run_in_executor(None, _encode_tile, writer, data, output_width,
+                                                 output_tile_height)
+        await resp.write(encoded)
+        offset += tile_height
+
+    await resp.write(writer.finish())
+    await resp.write_eof()
+    return resp
+
+
+def _image_options(query, format_: str) -> (Optional[int], float):
+    """
+    The quality and scale of the render `query`, parsed before a tab is taken so that bad values don't cost a render.
+    """
+    try:
+        quality = None
+        if format_ in LOSSY_FORMATS:
+            quality = int(query.get('quality', DEFAULT_QUALITY))
+            if not 0 <= quality <= 100:
+                raise ValueError('quality must be between 0 and 100')
+
+        scale = float(query.get('scale', 1))
+        if scale <= 0:
+            raise ValueError('scale must be greater than 0')
+    except ValueError as e:
+        raise web.HTTPBadRequest(reason=str(e))
+    return quality, scale
+
+
+async def _screenshot(tab, timings: metrics.Timings, query, format_: str, quality: Optional[int],
+                      scale: float) -> bytes:
+    """
+    Capture the viewport, or the whole page with `render_all=1`, in a single `Page.captureScreenshot`.
+    """
+    width, height = _parse_viewport(query)
+    if query.get('render_all') == '1':
+        full_height = await _content_height(tab)
+        return await _full_page_screenshot(tab, timings, width, full_height, format_=format_, quality=quality,
+                                           scale=scale)
+    clip = page.Viewport(x=0, y=0, width=width, height=height, scale=scale) if scale != 1 else None
+    with timings.phase('capture'):
+        return await tab.screenshot(format_=format_, quality=quality, clip=clip)
+
+
+async def _render_image(request: web.Request, format_: str):
+    quality, scale = _image_options(request.query, format_)
+    timings = metrics.Timings()
+    async with _go(request.app, request.query, timings) as tab:
+        content_type = 'image/%s' % format_
+
+        # only PNG can be encoded incrementally, so other formats always attempt a single capture
+        if format_ != 'png' or request.query.get('render_all') != '1':
+            data = await _screenshot(tab, timings, request.query, format_, quality, scale)
+            return _with_timings(web.Response(body=data, content_type=content_type), timings)
+
+        width, _ = _parse_viewport(request.query)
+        full_height = await _content_height(tab)
+        if full_height > TILED_CAPTURE_THRESHOLD_PX:
+            return await _tiled_screenshot(request, tab, timings, width, full_height, scale=scale)
+
+        try:
+            data = await _full_page_screenshot(tab, timings, width, full_height, scale=scale)
+        except ProtocolError as e:
+            log.warning('Full page capture failed with "%s", falling back to tiled capture' % e)
+            return await _tiled_screenshot(request, tab, timings, width, full_height, scale=scale)
+        return _with_timings(web.Response(body=data, content_type=content_type), timings)
 
 
 async def render_png(request: web.Request):
     # https://splash.readthedocs.io/en/stable/api.html#render-png
-    tab = await _go(request)
-
-    should_render_all = True if request.query.get('render_all', False) == '1' else False
-
-    if not should_render_all:
-        data = await tab.screenshot()
-        return web.Response(body=data, content_type='image/png')
-
-    if should_render_all:
-        raw_viewport = request.query.get('viewport', '1024x768')
-        parts = raw_viewport.split('x')
-        width = int(parts[0])
-        height = int(parts[1])
-        cmd = page.Page.setDeviceMetricsOverride(width=int(width),
-                                                 height=int(height),
-                                                 deviceScaleFactor=0.0,
-                                                 mobile=False)
-        await tab.send_command(cmd)
-
-        # model numbers affected by device metrics, so needs to come after
-        res = await tab.send_command(dom.DOM.getDocument())
-        doc_node_id = res['ack']['result']['root'].nodeId
-        res = await tab.send_command(dom.DOM.querySelector(selector='body', nodeId=doc_node_id))
-        body_node_id = res['ack']['result']['nodeId']
-        res = await tab.send_command(dom.DOM.getBoxModel(nodeId=body_node_id))
-        full_height = res['ack']['result']['model'].height
-        log.debug('full_height = %s' % full_height)
-
-        offset = 0
-        import base64
-        from PIL import Image
-        from io import BytesIO
-        full_image = Image.new('RGB', (int(width), int(full_height)))
-        delta = int(height)
-        while offset < full_height + 1:  # TODO: cut+paste to exact dimensions
-            await tab.send_command(runtime.Runtime.evaluate('window.scrollTo(0, %s)' % offset))
-            result = await tab.send_command(page.Page.captureScreenshot(format='png', fromSurface=False))
-            base64_data = result['ack']['result']['data']
-            snapshot = Image.open(BytesIO(base64.b64decode(base64_data)))
-            full_image.paste(snapshot, (0, offset))
-            offset += delta
-        output = BytesIO()
-        full_image.save(output, format='png')
-        return web.Response(body=output.getvalue(), content_type='image/png')
+    return await _render_image(request, 'png')
+
+
+async def render_jpeg(request: web.Request):
+    # https://splash.readthedocs.io/en/stable/api.html#render-jpeg
+    return await _render_image(request, 'jpeg')
+
+
+async def render_webp(request: web.Request):
+    return await _render_image(request, 'webp')
+
+
+def _pdf_options(query) -> dict:
+    """
+    The `Page.printToPDF` params of the render `query`, with sizes in inches.
+    """
+    options = {
+        'landscape': query.get('landscape') == '1',
+        'printBackground': query.get('print_background') == '1',
+    }
+    try:
+        paper_size = query.get('paper_size')
+        if paper_size:
+            if paper_size.lower() in PAPER_SIZES:
+                width, height = PAPER_SIZES[paper_size.lower()]
+            else:
+                width, height = (float(v) for v in paper_size.split('x'))
+            if width <= 0 or height <= 0:
+                raise ValueError('paper_size must be greater than 0')
+            options['paperWidth'], options['paperHeight'] = width, height
+        for side in PDF_MARGINS:
+            margin = query.get('margin_%s' % side, query.get('margin'))
+            if margin is not None:
+                margin = float(margin)
+                if margin < 0:
+                    raise ValueError('margins can not be negative')
+                options['margin%s' % side.capitalize()] = margin
+    except ValueError as e:
+        raise web.HTTPBadRequest(reason='invalid pdf option: %s' % e)
+    return options
+
+
+async def render_pdf(request: web.Request):
+    options = _pdf_options(request.query)
+    timings = metrics.Timings()
+    async with _go(request.app, request.query, timings) as tab:
+        with timings.phase('capture'):
+            pdf = await tab.print_to_pdf(**options)
+        # the PDF is piped from Chrome in chunks as it is read, so `Server-Timing` leaves out the reading
+        resp = _with_timings(web.StreamResponse(headers={'Content-Type': 'application/pdf'}), timings)
+        try:
+            await resp.prepare(request)
+            async for chunk in pdf:
+                await resp.write(chunk)
+        finally:
+            # closes the stream in Chrome should the client go away
+            await pdf.aclose()
+        await resp.write_eof()
+        return resp
+
+
+async def _stream_frames(request: web.Request, resp: web.StreamResponse, cast: screencast.Screencast):
+    """
+    Write every frame of `cast` to `resp` as a part of a multipart MJPEG stream, until the viewer goes away.
+    """
+    try:
+        async for frame in cast.frames():
+            if not resp.prepared:
+                await resp.prepare(request)
+            # waits on the viewer to read, which holds off acknowledging the frame
+            await resp.write(b'--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n%s\r\n'
+                             % (MJPEG_BOUNDARY, len(frame), frame))
+    except ConnectionResetError:
+        log.debug('Screencast viewer went away')
+
+
+async def render_screencast(request: web.Request):
+    query = request.query
+    width, height = _parse_viewport(query)
+    try:
+        duration_s = float(query.get('duration', SCREENCAST_DEFAULT_DURATION_S))
+        if not 0 < duration_s <= SCREENCAST_MAX_DURATION_S:
+            raise ValueError('duration must be greater than 0 and at most %ss' % SCREENCAST_MAX_DURATION_S)
+        cast = screencast.Screencast(max_width=int(query.get('max_width', width)),
+                                     max_height=int(query.get('max_height', height)),
+                                     quality=int(query.get('quality', screencast.DEFAULT_QUALITY)),
+                                     max_fps=float(query.get('max_fps', screencast.DEFAULT_FPS)))
+    except ValueError as e:
+        raise web.HTTPBadRequest(reason=str(e))
+
+    resp = web.StreamResponse(headers={
+        'Content-Type': 'multipart/x-mixed-replace; boundary=%s' % MJPEG_BOUNDARY.decode(),
+        'Cache-Control': 'no-cache',
+    })
+    deadline = asyncio.get_event_loop().time() + duration_s
+    # streaming starts with navigation, so the whole session can be watched
+    writer = asyncio.ensure_future(_stream_frames(request, resp, cast))
+    try:
+        async with _go(request.app, query, metrics.Timings(), cast=cast):
+            await asyncio.wait_for(asyncio.shield(writer), timeout=deadline - asyncio.get_event_loop().time())
+    except asyncio.TimeoutError:
+        pass
+    except asyncio.CancelledError:
+        # an Exception before python 3.8, raised when the viewer disconnects
+        raise
+    except Exception as e:
+        # once frames went out, the viewer can only be told by the stream ending
+        if not resp.prepared:
+            raise
+        log.warning('Screencast ended early: %s' % e)
+    finally:
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+
+    if not writer.cancelled():
+        # the viewer went away
+        return resp
+    if not resp.prepared:
+        await resp.prepare(request)
+    await resp.write(b'--%s--\r\n' % MJPEG_BOUNDARY)
+    await resp.write_eof()
+    return resp
+
+
+async def _frame_info(tab, frame_tree: dict, should_include_html: bool) -> dict:
+    """
+    Describe a child frame in the format of splash's `childFrames`, evaluating inside an isolated world of the frame
+    so that the page's own scripts can't interfere.
+    """
+    frame = frame_tree['frame']
+    res = await tab.send_command(page.Page.createIsolatedWorld(frameId=frame['id'], worldName='chromewhip'))
+    context_id = res['ack']['result']['executionContextId']
+    result = await tab.evaluate('document.title', context_id=context_id)
+    info = {
+        'url': frame['url'],
+        'requestedUrl': frame['url'],
+        'frameName': frame.get('name', ''),
+        'title': result['ack']['result']['result'].value,
+    }
+
+    res = await tab.send_command(dom.DOM.getFrameOwner(frameId=frame['id']))
+    res = await tab.send_command(dom.DOM.getBoxModel(backendNodeId=res['ack']['result']['backendNodeId']))
+    model = res['ack']['result']['model']
+    info['geometry'] = [model.content[0], model.content[1], model.width, model.height]
+
+    if should_include_html:
+        result = await tab.evaluate('document.documentElement.outerHTML', context_id=context_id)
+        info['html'] = result['ack']['result']['result'].value
+
+    info['childFrames'] = [await _frame_info(tab, child, should_include_html)
+                           for child in frame_tree.get('childFrames') or []]
+    return info
+
+
+async def _render_json_output(tab, timings: metrics.Timings, query, image_options: dict) -> dict:
+    """
+    :param image_options: quality and scale of each requested image format, from `_image_options`
+    """
+    width, height = _parse_viewport(query)
+
+    result = await tab.evaluate('JSON.stringify([document.location.href, document.title])')
+    url, title = json.loads(result['ack']['result']['result'].value)
+    output = {
+        'url': url,
+        'requestedUrl': query.get('url'),
+        'geometry': [0, 0, width, height],
+        'title': title,
+    }
+
+    if query.get('html') == '1':
+        with timings.phase('capture'):
+            output['html'] = (await tab.html()).decode()
+
+    if query.get('iframes') == '1':
+        # child frames can't be located without the DOM agent having seen the document
+        await tab.send_command(dom.DOM.getDocument())
+        res = await tab.send_command(page.Page.getFrameTree())
+        frame_tree = res['ack']['result']['frameTree']
+        output['childFrames'] = [await _frame_info(tab, child, 'html' in output)
+                                 for child in frame_tree.childFrames or []]
+
+    for format_, (quality, scale) in image_options.items():
+        data = await _screenshot(tab, timings, query, format_, quality, scale)
+        with timings.phase('encode'):
+            output[format_] = base64.b64encode(data).decode()
+
+    return output
+
+
+async def _render_json(app: web.Application, query, timings: metrics.Timings) -> dict:
+    har_collector = har.HarCollector() if query.get('har') == '1' else None
+    image_options = {f: _image_options(query, f) for f in ('png', 'jpeg') if query.get(f) == '1'}
+
+    # every artifact is produced from this single navigation
+    async with _go(app, query, timings, har_collector=har_collector) as tab:
+        output = await _render_json_output(tab, timings, query, image_options)
+        if har_collector and query.get('response_body') == '1':
+            await har_collector.fetch_bodies(tab)
+    if har_collector:
+        output['har'] = har_collector.to_har(title=output['title'])
+    return output
+
+
+async def render_json(request: web.Request):
+    # https://splash.readthedocs.io/en/stable/api.html#render-json
+    timings = metrics.Timings()
+    output = await _render_json(request.app, request.query, timings)
+    if request.query.get('timings') == '1':
+        output['timings'] = timings.to_dict()
+    with timings.phase('encode'):
+        text = json.dumps(output)
+    return _with_timings(web.Response(text=text, content_type='application/json'), timings)
+
+
+async def render_har(request: web.Request):
+    # https://splash.readthedocs.io/en/stable/api.html#render-har
+    timings = metrics.Timings()
+    har_collector = har.HarCollector()
+    async with _go(request.app, request.query, timings, har_collector=har_collector) as tab:
+        result = await tab.evaluate('document.title')
+        title = result['ack']['result']['result'].value
+        if request.query.get('response_body') == '1':
+            with timings.phase('capture'):
+                await har_collector.fetch_bodies(tab)
+    with timings.phase('encode'):
+        text = json.dumps(har_collector.to_har(title=title))
+    return _with_timings(web.Response(text=text, content_type='application/json'), timings)
+
+
+def _query_value(value) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+def _batch_queries(body) -> [dict]:
+    """
+    Turn a `/render.batch` body into the query params of each item, where an item is either a URL or an object of
+    render.json params that override the batch wide `options`.
+    """
+    items = body.get('items') if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise web.HTTPBadRequest(reason='items must be a non empty list')
+    defaults = body.get('options') or {}
+    if not isinstance(defaults, dict):
+        raise web.HTTPBadRequest(reason='options must be an object')
+
+    queries = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'url': item}
+        elif not isinstance(item, dict):
+            raise web.HTTPBadRequest(reason='each item must be a url or an object of render options')
+        options = dict(defaults, **item)
+        queries.append({k: _query_value(v) for k, v in options.items()})
+    return queries
+
+
+async def _render_batch_item(app: web.Application, index: int, query: dict, batch_started: float) -> dict:
+    started = time.monotonic()
+    timings = metrics.Timings()
+    line = {'index': index, 'url': query.get('url')}
+    try:
+        line['result'] = await _render_json(app, query, timings)
+    except web.HTTPException as e:
+        line['error'] = e.reason
+    except ChromewhipException as e:
+        line['error'] = e.args[0]
+    except asyncio.CancelledError:
+        # an Exception before python 3.8, which must still stop the worker once the client went away
+        raise
+    except Exception as e:
+        log.exception('Unexpected error rendering batch item %s' % index)
+        line['error'] = repr(e)
+    line['timing'] = {
+        'started': round(started - batch_started, 3),
+        'elapsed': round(time.monotonic() - started, 3),
+        'phases': timings.to_dict(),
+    }
+    return line
+
+
+async def render_batch(request: web.Request):
+    """
+    Render many URLs as with render.json, streaming one JSON line per item as soon as it finishes, so that
+    a slow page never holds back the others.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(reason='request body must be JSON')
+    queries = _batch_queries(body)
+    try:
+        concurrency = int(body.get('concurrency', request.app['tab-pool'].size))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason='concurrency must be an integer')
+    if concurrency < 1:
+        raise web.HTTPBadRequest(reason='concurrency must be at least 1')
+
+    resp = web.StreamResponse(headers={'Content-Type': NDJSON_CONTENT_TYPE})
+    await resp.prepare(request)
+
+    batch_started = time.monotonic()
+    results = asyncio.Queue()
+    pending = iter(enumerate(queries))
+
+    async def worker():
+        # workers share the iterator, so at most `concurrency` items are ever in flight
+        for index, query in pending:
+            results.put_nowait(await _render_batch_item(request.app, index, query, batch_started))
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(queries)))]
+    try:
+        for _ in range(len(queries)):
+            line = await results.get()
+            await resp.write(json.dumps(line).encode() + b'\n')
+    finally:
+        # the client may have gone away, in which case the rest of the batch isn't worth rendering
+        for w in workers:
+            w.cancel()
+    await resp.write_eof()
+    return resp
+
+
+async def expose_metrics(request: web.Request):
+    pool = request.app['tab-pool']
+    metrics.POOL_TABS.set(pool.in_use, state='in_use')
+    metrics.POOL_TABS.set(pool.size - pool.in_use, state='idle')
+    metrics.POOL_WAITING.set(pool.waiting)
+
+    processes = {'chromewhip': 'self'}
+    chrome = request.app.get('chrome-process')
+    if chrome is not None:
+        processes['chrome'] = chrome.pid
+    for name, pid in processes.items():
+        rss = metrics.resident_memory_bytes(pid)
+        if rss is not None:
+            metrics.RESIDENT_MEMORY.set(rss, process=name)
 
+    return web.Response(body=metrics.REGISTRY.expose().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+
+from chromewhip.protocol import emulation, network, page
+
+# how long the network must stay quiet for the page to count as idle, as with puppeteer
+NETWORK_IDLE_S = 0.5
+# upper bound for `wait_until` when no `wait` is given
+DEFAULT_TIMEOUT_S = 30
+
+LIFECYCLE_EVENT_NAMES = {
+    'domcontentloaded': 'DOMContentLoaded',
+    'load': 'load',
+}
+# maximum number of requests still allowed in flight for the network to count as idle
+NETWORK_IDLE_LIMITS = {
+    'networkidle0': 0,
+    'networkidle2': 2,
+}
+WAIT_UNTIL_OPTIONS = tuple(LIFECYCLE_EVENT_NAMES) + tuple(NETWORK_IDLE_LIMITS)
+
+log = logging.getLogger('chromewhip.waiting')
+
+
+class PageSettledWaiter:
+    """ Waits for a navigation to reach a `wait_until` state, so renders return as soon as the page is settled.
+
+    `domcontentloaded` and `load` follow `Page.lifecycleEvent` for the navigation's loader, while `networkidle0`
+    and `networkidle2` also require that no more than 0 or 2 requests stay in flight for `NETWORK_IDLE_S` after
+    the load event.
+    """
+    def __init__(self, wait_until: str):
+        if wait_until not in WAIT_UNTIL_OPTIONS:
+            raise ValueError('wait_until must be one of %s' % ', '.join(WAIT_UNTIL_OPTIONS))
+        self._lifecycle_name = LIFECYCLE_EVENT_NAMES.get(wait_until, LIFECYCLE_EVENT_NAMES['load'])
+        self._idle_limit = NETWORK_IDLE_LIMITS.get(wait_until)
+        self._lifecycle_events = set()
+        self._is_navigating = False
+        self._loader_id = None
+        self._in_flight = set()
+        self._idle_handle = None
+        self._lifecycle_reached = asyncio.Event()
+        self._network_idle = asyncio.Event()
+
+    @property
+    def _event_types(self):
+        types = [page.LifecycleEventEvent]
+        if self._idle_limit is not None:
+            types += [network.RequestWillBeSentEvent, network.LoadingFinishedEvent, network.LoadingFailedEvent]
+        return types
+
+    async def attach(self, tab):
+        for event_cls in self._event_types:
+            tab.add_event_listener(event_cls, self.on_event)
+        await tab.send_command(page.Page.setLifecycleEventsEnabled(enabled=True))
+        if self._idle_limit is not None:
+            await tab.enable('Network')
+
+    async def detach(self, tab):
+        for event_cls in self._event_types:
+            tab.remove_event_listener(event_cls, self.on_event)
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        try:
+            await tab.send_command(page.Page.setLifecycleEventsEnabled(enabled=False))
+        finally:
+            if self._idle_limit is not None:
+                await tab.disable('Network')
+
+    def on_event(self, event):
+        if isinstance(event, page.LifecycleEventEvent):
+            self._lifecycle_events.add((event.loaderId, event.name))
+            self._check_lifecycle()
+            return
+
+        if isinstance(event, network.RequestWillBeSentEvent):
+            self._in_flight.add(event.requestId)
+        else:
+            self._in_flight.discard(event.requestId)
+        self._check_network_idle()
+
+    def _check_lifecycle(self):
+        if self._lifecycle_reached.is_set():
+            return
+        if not self._is_navigating:
+            # the navigation's loader isn't known until `Page.navigate` is acknowledged
+            return
+        if any(name == self._lifecycle_name and (self._loader_id is None or loader_id == self._loader_id)
+               for loader_id, name in self._lifecycle_events):
+            self._lifecycle_reached.set()
+            self._check_network_idle()
+
+    def _check_network_idle(self):
+        if self._idle_limit is None or not self._lifecycle_reached.is_set():
+            return
+        if len(self._in_flight) > self._idle_limit:
+            if self._idle_handle:
+                self._idle_handle.cancel()
+                self._idle_handle = None
+        elif not self._idle_handle:
+            self._idle_handle = asyncio.get_event_loop().call_later(NETWORK_IDLE_S, self._network_idle.set)
+
+    async def wait(self, loader_id: str, timeout: float):
+        """
+        Wait for the navigation of `loader_id` to settle. A navigation without a loader, such as one within the
+        document, settles on any lifecycle event.
+
+        :return: whether the page settled before `timeout`
+        """
+        self._is_navigating = True
+        self._loader_id = loader_id or None
+        self._check_lifecycle()
+        settled = self._network_idle if self._idle_limit is not None else self._lifecycle_reached
+        try:
+            await asyncio.wait_for(settled.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            log.debug('page did not settle within %ss, continuing anyway' % timeout)
+            return False
+
+
+class VirtualTimeWaiter:
+    """ Fast-forwards timers with virtual time, settling once `budget_ms` of virtual time has elapsed.
+
+    Virtual time only advances while no network fetches are pending, so `setTimeout` chains run as fast as the CPU
+    allows without racing the page's own requests.
+    """
+    def __init__(self, budget_ms: float):
+        if budget_ms <= 0:
+            raise ValueError('virtual_time_budget must be greater than 0')
+        self._budget_ms = budget_ms
+        self._expired = asyncio.Event()
+
+    async def attach(self, tab):
+        tab.add_event_listener(emulation.VirtualTimeBudgetExpiredEvent, self.on_event)
+        # deferring the policy until navigation starts keeps the old page from spending the budget
+        await tab.send_command(emulation.Emulation.setVirtualTimePolicy(policy='pauseIfNetworkFetchesPending',
+                                                                        budget=self._budget_ms,
+                                                                        waitForNavigation=True))
+
+    async def detach(self, tab):
+        tab.remove_event_listener(emulation.VirtualTimeBudgetExpiredEvent, self.on_event)
+        await tab.send_command(emulation.Emulation.setVirtualTimePolicy(policy='advance'))
+
+    def on_event(self, event):
+        self._expired.set()
+
+    async def wait(self, loader_id: str, timeout: float):
+        """
+        :return: whether the budget expired before `timeout` of wall clock time
+        """
+        try:
+            await asyncio.wait_for(self._expired.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            log.debug('virtual time budget did not expire within %ss, continuing anyway' % timeout)
+            return False
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from chromewhip import metrics
+from chromewhip.chrome import TabCrashedError
+
+CHECK_INTERVAL_S = 5
+# a renderer busy for longer than this on a trivial evaluation is taken to be hung
+PING_TIMEOUT_S = 5
+BROWSER_PING_TIMEOUT_S = 5
+BROWSER_START_TIMEOUT_S = 30
+
+log = logging.getLogger('chromewhip.watchdog')
+
+
+class Watchdog:
+    """ Checks on the browser and every pooled tab, respawning whichever stopped responding.
+
+    Crashed and detached tabs are reported by Chrome itself, hung renderers are found with a `Runtime.evaluate`
+    ping that idle tabs must answer within `PING_TIMEOUT_S`, and a dead browser by its process exiting or its HTTP
+    endpoint going quiet. Commands waiting on a dead tab fail straight away, and each tab is replaced on its own
+    so healthy tabs keep rendering.
+    """
+    def __init__(self, app, interval_s: float = CHECK_INTERVAL_S, ping_timeout_s: float = PING_TIMEOUT_S):
+        self._app = app
+        self._interval_s = interval_s
+        self._ping_timeout_s = ping_timeout_s
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._interval_s)
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                # an Exception before python 3.8, which must still stop the watchdog on shutdown
+                raise
+            except Exception:
+                log.exception('Watchdog check failed')
+
+    async def check(self):
+        pool = self._app['tab-pool']
+        tabs = pool.tabs
+        if not tabs:
+            # nothing to look after until the first render starts the pool
+            return
+
+        if not await self._is_browser_alive():
+            await self.respawn_browser()
+            return
+
+        # a tab in use may well be busy with a heavy page, so only idle tabs are expected to answer promptly
+        idle = [t for t in pool.idle_tabs if t.is_alive]
+        responses = await asyncio.gather(*[t.ping(self._ping_timeout_s) for t in idle], return_exceptions=True)
+        for tab, is_responding in zip(idle, responses):
+            if isinstance(is_responding, Exception):
+                # e.g. a lost connection, which the next command reconnects
+                log.warning('Unable to ping tab %s: %s' % (tab.id_, is_responding))
+            elif not is_responding:
+                log.error('Tab %s is not responding' % tab.id_)
+                tab.fail(TabCrashedError('Tab %s is not responding' % tab.id_))
+                pool.replace(tab, 'hung')
+        for tab in tabs:
+            if not tab.is_alive:
+                pool.replace(tab, 'crashed')
+
+    async def _is_browser_alive(self) -> bool:
+        process = self._app.get('chrome-process')
+        if process is not None and process.returncode is not None:
+            log.error('Chrome exited with code %s' % process.returncode)
+            return False
+        return await self._app['chrome-driver'].ping(BROWSER_PING_TIMEOUT_S)
+
+    async def respawn_browser(self):
+        launch = self._app.get('chrome-launcher')
+        if launch is None:
+            log.error('Chrome is not responding, and can not be respawned as it was not launched by chromewhip')
+            return
+
+        log.error('Chrome is not responding, respawning it')
+        metrics.CHROME_RESTARTS.inc()
+        pool = self._app['tab-pool']
+        for tab in pool.tabs:
+            tab.fail(TabCrashedError('Tab %s was lost with the browser' % tab.id_))
+
+        process = self._app.get('chrome-process')
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        self._app['chrome-process'] = await launch()
+
+        chrome = self._app['chrome-driver']
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + BROWSER_START_TIMEOUT_S
+        while not await chrome.ping(1):
+            if loop.time() > deadline:
+                log.error('Respawned Chrome did not start within %ss' % BROWSER_START_TIMEOUT_S)
+                return
+            await asyncio.sleep(0.5)
+
+        chrome.reset()
+        await pool.restart()
@@ -1,10 +1,15 @@
 #!/bin/bash
 
-echo "Starting window manager..."
-fluxbox -display $DISPLAY &
+FLAGS=""
+if [ "$CHROMEWHIP_HEADFUL" = "1" ]; then
+    FLAGS="--headful"
 
-echo "Starting VNC server..."
-x11vnc -forever -shared -rfbport 5900 -display $DISPLAY &
+    echo "Starting window manager..."
+    fluxbox -display $DISPLAY &
+
+    echo "Starting VNC server..."
+    x11vnc -forever -shared -rfbport 5900 -display $DISPLAY &
+fi
 
 echo "Starting Chromewhip..."
-python3.7 -m chromewhip.__init__ --js-profiles-path /usr/jsprofiles
+python3.7 -m chromewhip.__init__ --js-profiles-path /usr/jsprofiles $FLAGS
@@ -0,0 +1,83 @@
+import pytest
+
+from chromewhip import blocking
+from chromewhip.protocol import fetch, network, page
+
+
+def _paused(url, resource_type):
+    request = network.Request(url=url, method='GET', headers={}, initialPriority='Low',
+                              referrerPolicy='no-referrer')
+    return fetch.RequestPausedEvent(requestId='interception-1', request=request, frameId='1000.1',
+                                    resourceType=resource_type)
+
+
+def test_request_blocker_from_query():
+    blocker = blocking.RequestBlocker.from_query({'images': '0', 'block_types': 'font, media',
+                                                  'block_urls': '*.doubleclick.net/*,*/ads.js'})
+    assert sorted(p.resourceType for p in blocker.patterns if p.resourceType) == ['Font', 'Image', 'Media']
+    assert [p.urlPattern for p in blocker.patterns if not p.resourceType] == ['*.doubleclick.net/*', '*/ads.js']
+
+    assert blocker.should_block(_paused('http://example.com/logo.png', 'Image'))
+    assert blocker.should_block(_paused('http://example.com/static/ads.js', 'Script'))
+    assert not blocker.should_block(_paused('http://example.com/app.js', 'Script'))
+
+
+def test_request_blocker_from_query_nothing_blocked():
+    assert blocking.RequestBlocker.from_query({'images': '1'}) is None
+
+
+def test_request_blocker_from_query_unknown_type():
+    with pytest.raises(ValueError):
+        blocking.RequestBlocker.from_query({'block_types': 'fonts'})
+
+
+def test_request_blocker_only_expands_wildcards():
+    blocker = blocking.RequestBlocker(url_patterns=['*/ads[1].js', 'http://?.example.com/*'])
+    assert blocker.should_block(_paused('http://example.com/ads[1].js', 'Script'))
+    assert not blocker.should_block(_paused('http://example.com/ads1.js', 'Script'))
+    assert blocker.should_block(_paused('http://a.example.com/x', 'Script'))
+
+
+class BlockEverything:
+
+    def match(self, url, resource_type=None, document_url=None):
+        return True
+
+
+def test_request_blocker_never_filters_main_document():
+    blocker = blocking.RequestBlocker(filters=[BlockEverything()], document_url='http://example.com')
+    blocker._main_frame_id = '1000.1'
+    # the document's URL differs from the one requested once normalised
+    assert not blocker.should_block(_paused('http://example.com/', 'Document'))
+    assert blocker.should_block(_paused('http://example.com/', 'Script'))
+
+
+class FrameTreeTab:
+    """ Acknowledges every command, converting acks like `ChromeTab.send_command` does. """
+
+    def __init__(self):
+        self.listeners = []
+
+    def add_event_listener(self, event_cls, callback):
+        self.listeners.append(callback)
+
+    def remove_event_listener(self, event_cls, callback):
+        self.listeners.remove(callback)
+
+    async def send_command(self, command):
+        payload, converter = command
+        if payload['method'] == 'Page.getFrameTree':
+            result = {'frameTree': {'frame': {'id': '1000.1', 'loaderId': 'loader', 'url': 'http://example.com/',
+                                              'securityOrigin': 'http://example.com', 'mimeType': 'text/html'}}}
+            return {'ack': {'result': converter(result)}}
+        return {'ack': {'result': {}}}
+
+
+@pytest.mark.asyncio
+async def test_request_blocker_attach_finds_main_frame(event_loop):
+    blocker = blocking.RequestBlocker(filters=[BlockEverything()], document_url='http://example.com')
+    tab = FrameTreeTab()
+    await blocker.attach(tab)
+    assert not blocker.should_block(_paused('http://example.com/', 'Document'))
+    await blocker.detach(tab)
+    assert not tab.listeners
@@ -1,4 +1,5 @@
 import asyncio
+import base64
 import copy
 import json
 import logging
@@ -10,7 +11,8 @@ from websockets.exceptions import ConnectionClosed
 
 
 from chromewhip import chrome, helpers
-from chromewhip.protocol import page, network
+from chromewhip.protocol import inspector, io, page, network, runtime
+from chromewhip.transport import Transport, TransportClosed
 
 TEST_HOST = 'localhost'
 TEST_PORT = 32322
@@ -244,6 +246,311 @@ async def test_send_command_can_trigger_on_event_with_input_event(event_loop, ch
     server.close()
     await server.wait_closed()
 
+@pytest.mark.asyncio
+async def test_event_listener_receives_events(event_loop, chrome_tab):
+    msg_id = 4
+    frame_id = '3228.1'
+
+    chrome_tab._message_id = msg_id - 1
+    p = page.Page.enable()
+    fsle = page.FrameStoppedLoadingEvent(frame_id)
+
+    triggers = {
+        msg_id: [{'id': msg_id, 'result': {}}, fsle, fsle]
+    }
+
+    test_server = init_test_server(triggers)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    received = []
+    chrome_tab.add_event_listener(page.FrameStoppedLoadingEvent, received.append)
+    await chrome_tab.send_command(p)
+    await asyncio.sleep(0.1)
+    assert len(received) == 2
+    assert all(e.frameId == frame_id for e in received)
+
+    chrome_tab.remove_event_listener(page.FrameStoppedLoadingEvent, received.append)
+    assert not chrome_tab._event_listeners[page.FrameStoppedLoadingEvent.js_name]
+
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_run_script_compiles_once_per_document(event_loop, chrome_tab, monkeypatch):
+    monkeypatch.setattr(chrome, 'DOMAIN_DISABLE_DELAY_S', 0.05)
+    msg_id = 4
+    script = 'document.title'
+    script_id = '42'
+    chrome_tab._message_id = msg_id - 1
+
+    def message(id_, command):
+        msg = copy.copy(command[0])
+        msg['id'] = id_
+        return msg
+
+    evaluate = runtime.Runtime.evaluate(script)
+    enable = runtime.Runtime.enable()
+    disable = runtime.Runtime.disable()
+    compile_ = runtime.Runtime.compileScript(script, sourceURL='', persistScript=True)
+    run = runtime.Runtime.runScript(script_id)
+    run_ack = {'result': {'result': {'type': 'string', 'value': 'test'}}}
+    navigated = page.FrameNavigatedEvent(page.Frame('3228.1', 'test', 'http://example.com', 'test', 'text/html'))
+
+    triggers = {
+        # a script only compiled once it runs again in the same document
+        msg_id: [dict(run_ack, id=msg_id)],
+        msg_id + 1: [{'id': msg_id + 1, 'result': {}}],
+        msg_id + 2: [{'id': msg_id + 2, 'result': {'scriptId': script_id}}],
+        msg_id + 3: [dict(run_ack, id=msg_id + 3)],
+        # a new document replaces the context the script was compiled in
+        msg_id + 4: [dict(run_ack, id=msg_id + 4), navigated],
+        msg_id + 5: [{'id': msg_id + 5, 'result': {}}],
+        msg_id + 6: [dict(run_ack, id=msg_id + 6)],
+    }
+    q = queue.Queue()
+    for i, command in enumerate([evaluate, enable, compile_, run, run, disable, evaluate]):
+        q.put(message(msg_id + i, command))
+
+    test_server = init_test_server(triggers, expected=q)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    for _ in range(3):
+        result = await chrome_tab.run_script(script)
+        assert result['ack']['result']['result'].value == 'test'
+    await asyncio.sleep(0.1)
+    await chrome_tab.run_script(script)
+    assert q.empty()
+
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_tab_skips_commands_for_state_already_applied(event_loop, chrome_tab):
+    msg_id = 4
+    chrome_tab._message_id = msg_id - 1
+
+    commands = [page.Page.enable(),
+                page.Page.setDeviceMetricsOverride(width=1024, height=768, deviceScaleFactor=0.0, mobile=False),
+                page.Page.setDeviceMetricsOverride(width=1024, height=4096, deviceScaleFactor=0.0, mobile=False)]
+    triggers = {}
+    q = queue.Queue()
+    for i, command in enumerate(commands):
+        msg = copy.copy(command[0])
+        msg['id'] = msg_id + i
+        q.put(msg)
+        triggers[msg_id + i] = [{'id': msg_id + i, 'result': {}}]
+
+    test_server = init_test_server(triggers, expected=q)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    for _ in range(2):
+        with pytest.deprecated_call():
+            await chrome_tab.enable_page_events()
+        await chrome_tab.set_device_metrics(1024, 768)
+    await chrome_tab.set_device_metrics(1024, 4096)
+    assert q.empty()
+
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_domains_are_reference_counted(event_loop, chrome_tab, monkeypatch):
+    monkeypatch.setattr(chrome, 'DOMAIN_DISABLE_DELAY_S', 0.05)
+    msg_id = 4
+    chrome_tab._message_id = msg_id - 1
+
+    triggers = {}
+    q = queue.Queue()
+    for i, command in enumerate([network.Network.enable(), network.Network.disable()]):
+        msg = copy.copy(command[0])
+        msg['id'] = msg_id + i
+        q.put(msg)
+        triggers[msg_id + i] = [{'id': msg_id + i, 'result': {}}]
+
+    test_server = init_test_server(triggers, expected=q)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    await asyncio.gather(chrome_tab.enable('Network'), chrome_tab.enable('Network'))
+    await chrome_tab.disable('Network')
+    await chrome_tab.disable('Network')
+    # enabling again within the delay keeps the domain enabled without any commands
+    await chrome_tab.enable('Network')
+    await asyncio.sleep(0.1)
+    assert q.qsize() == 1
+
+    await chrome_tab.disable('Network')
+    await asyncio.sleep(0.1)
+    assert q.empty()
+    with pytest.raises(ValueError):
+        await chrome_tab.disable('Network')
+
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_reconnect_enables_domains_still_in_use(event_loop, chrome_tab):
+    msg_id = 4
+    chrome_tab._message_id = msg_id - 1
+
+    triggers = {}
+    q = queue.Queue()
+    for i in range(2):
+        msg = copy.copy(network.Network.enable()[0])
+        msg['id'] = msg_id + i
+        q.put(msg)
+        triggers[msg_id + i] = [{'id': msg_id + i, 'result': {}}]
+
+    test_server = init_test_server(triggers, expected=q)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    await chrome_tab.enable('Network')
+    # the new devtools session starts with every domain disabled
+    await chrome_tab.connect()
+    assert q.empty()
+    # already enabled on the new session, so no command is sent
+    await chrome_tab.enable('Network')
+
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_reconnect_injects_scripts_again(event_loop, chrome_tab):
+    msg_id = 4
+    chrome_tab._message_id = msg_id - 1
+
+    triggers = {}
+    q = queue.Queue()
+    for i in range(2):
+        msg = copy.copy(page.Page.addScriptToEvaluateOnNewDocument('window.injected = true')[0])
+        msg['id'] = msg_id + i
+        q.put(msg)
+        triggers[msg_id + i] = [{'id': msg_id + i, 'result': {'identifier': str(i)}}]
+
+    test_server = init_test_server(triggers, expected=q)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    await chrome_tab.set_injected_scripts(['window.injected = true'])
+    # scripts added over the previous devtools session went with it
+    await chrome_tab.connect()
+    await chrome_tab.set_injected_scripts(['window.injected = true'])
+    assert q.empty()
+
+    server.close()
+    await server.wait_closed()
+
+class DroppingTransport(Transport):
+    """ Acknowledges every command, or closes under the first command sent when `drop` is set. """
+
+    def __init__(self, drop: bool):
+        self._drop = drop
+        self._messages = asyncio.Queue()
+        self.closed = False
+
+    async def send(self, message):
+        ack = {'id': message['id'], 'result': {'result': {'type': 'number', 'value': 1}}}
+        self._messages.put_nowait(None if self._drop else ack)
+
+    async def recv(self):
+        message = await self._messages.get()
+        if message is None:
+            raise TransportClosed('Connection dropped', 1006)
+        return message
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_commands_in_flight_reconnect_once(event_loop):
+    transports = []
+
+    async def connect():
+        if transports:
+            # slow enough for every command in flight to try reconnecting
+            await asyncio.sleep(0.02)
+        transports.append(DroppingTransport(drop=not transports))
+        return transports[-1]
+
+    tab = chrome.ChromeTab('test', 'about:blank', None, '123', transport_factory=connect)
+    await tab.connect()
+    await asyncio.wait_for(asyncio.gather(*[tab.send_command(runtime.Runtime.evaluate('1')) for _ in range(3)]),
+                           timeout=1)
+    assert len(transports) == 2
+    assert transports[0].closed and not transports[1].closed
+    await tab.disconnect()
+
+@pytest.mark.asyncio
+async def test_crash_fails_commands_in_flight(event_loop, chrome_tab):
+    msg_id = 4
+    chrome_tab._message_id = msg_id - 1
+
+    # the renderer crashes before acknowledging the command
+    triggers = {
+        msg_id: [inspector.TargetCrashedEvent()]
+    }
+
+    test_server = init_test_server(triggers)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    with pytest.raises(chrome.TabCrashedError):
+        await asyncio.wait_for(chrome_tab.send_command(page.Page.reload()), timeout=1)
+    assert not chrome_tab.is_alive
+    # later commands fail without being sent, rather than waiting for a timeout
+    with pytest.raises(chrome.TabCrashedError):
+        await chrome_tab.send_command(page.Page.reload())
+    assert not chrome_tab._ack_events
+
+    server.close()
+    await server.wait_closed()
+
+@pytest.mark.asyncio
+async def test_print_to_pdf_reads_stream_in_chunks(event_loop, chrome_tab):
+    msg_id = 4
+    handle = 'stream-1'
+    chunks = [b'%PDF-1.4 ', b'%%EOF']
+    chrome_tab._message_id = msg_id - 1
+
+    commands = [page.Page.printToPDF(landscape=True, transferMode='ReturnAsStream'),
+                io.IO.read(handle, size=chrome.IO_READ_CHUNK_BYTES), io.IO.read(handle, size=chrome.IO_READ_CHUNK_BYTES),
+                io.IO.close(handle)]
+    acks = [{'data': '', 'stream': handle}] + \
+        [{'base64Encoded': True, 'data': base64.b64encode(c).decode(), 'eof': i == len(chunks) - 1}
+         for i, c in enumerate(chunks)] + [{}]
+    triggers = {}
+    q = queue.Queue()
+    for i, (command, ack) in enumerate(zip(commands, acks)):
+        msg = copy.copy(command[0])
+        msg['id'] = msg_id + i
+        q.put(msg)
+        triggers[msg_id + i] = [{'id': msg_id + i, 'result': ack}]
+
+    test_server = init_test_server(triggers, expected=q)
+    start_server = websockets.serve(test_server, TEST_HOST, TEST_PORT)
+    server = await start_server
+    await chrome_tab.connect()
+
+    pdf = await chrome_tab.print_to_pdf(landscape=True)
+    # the stream is closed once read
+    assert [c async for c in pdf] == chunks
+    assert q.empty()
+
+    server.close()
+    await server.wait_closed()
+
 @pytest.mark.asyncio
 async def xtest_can_register_callback_on_devtools_event(event_loop, chrome_tab):
     # TODO: double check this part of the api is implemented
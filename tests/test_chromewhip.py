@@ -8,7 +8,8 @@ PROJECT_ROOT = os.path.abspath(os.path.join(__file__, '../..'))
 sys.path.insert(0, PROJECT_ROOT)
 
 from chromewhip import setup_app
-from chromewhip.views import BS
+from chromewhip.views import BS, _image_options, _pdf_options
+from aiohttp import web
 from aiohttp.test_utils import TestClient as tc
 HTTPBIN_HOST = 'http://httpbin.org'
 
@@ -22,7 +23,7 @@ async def xtest_render_html_basic(event_loop):
     expected = BS(open(os.path.join(RESPONSES_DIR, 'httpbin.org.html.txt')).read()).prettify()
     client = tc(setup_app(loop=event_loop), loop=event_loop)
     await client.start_server()
-    resp = await client.get('/render.html?url={}'.format(quote('{}/html'.format(HTTPBIN_HOST))))
+    resp = await client.get('/render.html?prettify=1&url={}'.format(quote('{}/html'.format(HTTPBIN_HOST))))
     assert resp.status == 200
     text = await resp.text()
     assert expected == text
@@ -34,9 +35,27 @@ async def xtest_render_html_with_js_profile(event_loop):
     profile_path = os.path.join(PROJECT_ROOT, 'tests/resources/js/profiles/{}'.format(profile_name))
     client = tc(setup_app(loop=event_loop, js_profiles_path=profile_path), loop=event_loop)
     await client.start_server()
-    resp = await client.get('/render.html?url={}&js={}'.format(
+    resp = await client.get('/render.html?prettify=1&url={}&js={}'.format(
         quote('{}/html'.format(HTTPBIN_HOST)),
         profile_name))
     assert resp.status == 200
     text = await resp.text()
     assert expected == text
+
+
+def test_pdf_options_are_read_from_query():
+    options = _pdf_options({'paper_size': 'A4', 'margin': '0.5', 'margin_top': '1', 'landscape': '1'})
+    assert options == {'landscape': True, 'printBackground': False, 'paperWidth': 8.27, 'paperHeight': 11.69,
+                       'marginTop': 1.0, 'marginRight': 0.5, 'marginBottom': 0.5, 'marginLeft': 0.5}
+    assert _pdf_options({'paper_size': '4x6'})['paperWidth'] == 4.0
+
+    for query in ({'paper_size': 'A10'}, {'margin': '-1'}, {'paper_size': '0x6'}):
+        with pytest.raises(web.HTTPBadRequest):
+            _pdf_options(query)
+
+
+def test_image_options_reject_bad_values():
+    assert _image_options({'quality': '90', 'scale': '0.5'}, 'jpeg') == (90, 0.5)
+    for query in ({'quality': 'high'}, {'quality': '101'}, {'scale': '0'}, {'scale': 'half'}):
+        with pytest.raises(web.HTTPBadRequest):
+            _image_options(query, 'jpeg')
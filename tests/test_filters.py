@@ -0,0 +1,76 @@
+from chromewhip import filters
+
+RULES = """[Adblock Plus 2.0]
+! comment
+##.ad-banner
+||ads.example.com^
+||tracker.net/pixel
+/banner/*/img^
+-advert-
+@@||ads.example.com/allowed^
+||cdn.example.org^$script,third-party
+||social.com^$domain=news.com|~sub.news.com
+/^https?:\\/\\/regex\\.com/
+||popups.com^$popup
+"""
+
+
+def _engine():
+    return filters.FilterEngine.from_lines(RULES.splitlines())
+
+
+def test_filter_engine_skips_unsupported_lines():
+    # comments, element hiding, regex and unsupported option rules are dropped
+    assert len(_engine()) == 7
+
+
+def test_filter_engine_domain_rules():
+    engine = _engine()
+    assert engine.match('http://ads.example.com/script.js')
+    assert engine.match('https://sub.ads.example.com/')
+    assert not engine.match('http://example.com/script.js')
+    assert not engine.match('http://notads.example.com.evil.org/')
+    assert engine.match('http://tracker.net/pixel.gif')
+    assert not engine.match('http://tracker.net/page')
+
+
+def test_filter_engine_substring_rules():
+    engine = _engine()
+    assert engine.match('http://example.com/banner/123/img?x=1')
+    assert not engine.match('http://example.com/banner/123/imgs')
+    assert engine.match('http://example.com/some-advert-here.png')
+    assert engine.match('http://example.com/SOME-ADVERT-HERE.png')
+
+
+def test_filter_engine_exceptions():
+    engine = _engine()
+    assert not engine.match('http://ads.example.com/allowed/thing.js')
+
+
+def test_filter_engine_options():
+    engine = _engine()
+    url = 'http://cdn.example.org/lib.js'
+    assert engine.match(url, resource_type='Script', document_url='http://other.com/')
+    assert not engine.match(url, resource_type='Image', document_url='http://other.com/')
+    assert not engine.match(url, resource_type='Script', document_url='http://www.example.org/')
+
+    url = 'http://social.com/widget.js'
+    assert engine.match(url, document_url='http://news.com/article')
+    assert not engine.match(url, document_url='http://sub.news.com/article')
+    assert not engine.match(url, document_url='http://blog.com/')
+
+
+def test_filter_engine_compiled_cache(tmp_path):
+    list_fp = tmp_path / 'easylist.txt'
+    list_fp.write_text(RULES)
+    cache_dir = tmp_path / 'cache'
+
+    engine = filters.FilterEngine.from_file(str(list_fp), cache_dir=str(cache_dir))
+    cached = list(cache_dir.iterdir())
+    assert len(cached) == 1
+
+    engine = filters.FilterEngine.from_file(str(list_fp), cache_dir=str(cache_dir))
+    assert len(engine) == 7
+    assert engine.match('http://ads.example.com/script.js')
+
+    assert list(filters.load_filters(str(tmp_path), cache_dir=str(cache_dir))) == ['easylist']
@@ -0,0 +1,77 @@
+from chromewhip import har, helpers
+from chromewhip.protocol import network
+
+REQUEST_ID = '1000.1'
+
+
+def _request_will_be_sent(request_id, url, timestamp, redirect_response=None):
+    params = {
+        'requestId': request_id, 'loaderId': '1000.1', 'documentURL': url,
+        'request': {'url': url, 'method': 'GET', 'headers': {'Accept': 'text/html'},
+                    'initialPriority': 'VeryHigh', 'referrerPolicy': 'no-referrer-when-downgrade'},
+        'timestamp': timestamp, 'wallTime': 1500000000 + timestamp,
+        'initiator': {'type': 'other'}, 'type': 'Document', 'frameId': '1000.1',
+    }
+    if redirect_response:
+        params['redirectResponse'] = redirect_response
+    return helpers.json_to_event({'method': 'Network.requestWillBeSent', 'params': params})
+
+
+def _response(url, status, headers=None):
+    return {
+        'url': url, 'status': status, 'statusText': 'OK', 'headers': headers or {'Content-Type': 'text/html'},
+        'mimeType': 'text/html', 'connectionReused': False, 'connectionId': 1, 'encodedDataLength': 100,
+        'securityState': 'neutral', 'protocol': 'http/1.1',
+        'timing': {'requestTime': 10.0, 'proxyStart': -1, 'proxyEnd': -1, 'dnsStart': 1, 'dnsEnd': 3,
+                   'connectStart': 3, 'connectEnd': 8, 'sslStart': -1, 'sslEnd': -1, 'workerStart': -1,
+                   'workerReady': -1, 'sendStart': 8, 'sendEnd': 9, 'pushStart': 0, 'pushEnd': 0,
+                   'receiveHeadersEnd': 50},
+    }
+
+
+def test_har_collector_builds_entries_from_events():
+    url = 'http://example.com/?a=1'
+    collector = har.HarCollector()
+    collector.on_event(_request_will_be_sent(REQUEST_ID, url, 10.0))
+    collector.on_event(helpers.json_to_event({'method': 'Network.responseReceived', 'params': {
+        'requestId': REQUEST_ID, 'loaderId': '1000.1', 'timestamp': 10.05, 'type': 'Document',
+        'response': _response(url, 200)}}))
+    collector.on_event(network.LoadingFinishedEvent(requestId=REQUEST_ID, timestamp=10.1, encodedDataLength=1234))
+
+    log = collector.to_har(title='Example')['log']
+    assert log['version'] == '1.2'
+    assert log['pages'][0]['title'] == 'Example'
+    assert len(log['entries']) == 1
+
+    entry = log['entries'][0]
+    assert entry['request']['url'] == url
+    assert entry['request']['queryString'] == [{'name': 'a', 'value': '1'}]
+    assert entry['response']['status'] == 200
+    assert entry['response']['bodySize'] == 1234
+    assert entry['timings']['dns'] == 2
+    assert entry['timings']['connect'] == 5
+    assert entry['timings']['ssl'] == -1
+    assert entry['timings']['wait'] == 41
+    assert round(entry['timings']['receive']) == 50
+
+
+def test_har_collector_splits_redirects():
+    collector = har.HarCollector()
+    collector.on_event(_request_will_be_sent(REQUEST_ID, 'http://example.com/', 10.0))
+    redirect = _response('http://example.com/', 301, headers={'Location': 'https://example.com/'})
+    collector.on_event(_request_will_be_sent(REQUEST_ID, 'https://example.com/', 10.2, redirect_response=redirect))
+
+    entries = collector.to_har()['log']['entries']
+    assert [e['request']['url'] for e in entries] == ['http://example.com/', 'https://example.com/']
+    assert entries[0]['response']['status'] == 301
+    assert entries[0]['response']['redirectURL'] == 'https://example.com/'
+
+
+def test_har_collector_is_bounded():
+    collector = har.HarCollector(max_entries=2)
+    for i in range(5):
+        collector.on_event(_request_will_be_sent('1000.%s' % i, 'http://example.com/%s' % i, 10.0 + i))
+    log = collector.to_har()['log']
+    assert len(log['entries']) == 2
+    assert collector.dropped == 3
+    assert 'comment' in log
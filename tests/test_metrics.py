@@ -0,0 +1,57 @@
+import pytest
+
+from chromewhip import metrics
+
+
+def test_histogram_exposes_cumulative_buckets():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram('render_seconds', 'Render time.', ['phase'], buckets=(0.1, 1), registry=registry)
+    histogram.observe(0.05, phase='navigate')
+    histogram.observe(0.5, phase='navigate')
+    histogram.observe(2, phase='navigate')
+
+    assert registry.expose().splitlines() == [
+        '# HELP render_seconds Render time.',
+        '# TYPE render_seconds histogram',
+        'render_seconds_bucket{phase="navigate",le="0.1"} 1',
+        'render_seconds_bucket{phase="navigate",le="1"} 2',
+        'render_seconds_bucket{phase="navigate",le="+Inf"} 3',
+        'render_seconds_sum{phase="navigate"} 2.55',
+        'render_seconds_count{phase="navigate"} 3',
+    ]
+
+
+def test_counter_and_gauge_samples():
+    registry = metrics.Registry()
+    counter = metrics.Counter('requests_total', 'Requests.', ['endpoint', 'status'], registry=registry)
+    gauge = metrics.Gauge('waiting', 'Waiting renders.', registry=registry)
+    counter.inc(endpoint='/render.html', status=200)
+    counter.inc(endpoint='/render.html', status=200)
+    counter.inc(endpoint='/render "png"', status=500)
+
+    lines = registry.expose().splitlines()
+    assert 'requests_total{endpoint="/render.html",status="200"} 2' in lines
+    assert 'requests_total{endpoint="/render \\"png\\"",status="500"} 1' in lines
+    # unlabelled metrics are exposed before anything is recorded
+    assert 'waiting 0' in lines
+
+    with pytest.raises(ValueError):
+        counter.inc(endpoint='/render.html')
+    with pytest.raises(ValueError):
+        metrics.Gauge('waiting', 'Duplicate.', registry=registry)
+
+
+def test_timings_format_server_timing():
+    timings = metrics.Timings()
+    before = metrics.RENDER_PHASE_SECONDS.get(phase='capture')
+    timings.record('capture', 0.002)
+    timings.record('queue', 0.0015)
+    timings.record('capture', 0.003)
+
+    # phases are listed in the order they happen, with repeated phases summed
+    assert timings.to_dict() == {'queue': 1.5, 'capture': 5.0}
+    assert timings.server_timing() == 'queue;desc="Waiting for a tab";dur=1.5, capture;desc="Capture";dur=5.0'
+    assert metrics.RENDER_PHASE_SECONDS.get(phase='capture') == before + 2
+
+    with pytest.raises(ValueError):
+        timings.record('sleep', 1)
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from chromewhip import png
+
+
+def _pixels(width, height):
+    return bytes((x * 7 + y * 13 + c) % 256 for y in range(height) for x in range(width) for c in range(3))
+
+
+def test_png_stream_writer_roundtrip():
+    width, height = 5, 7
+    raw = _pixels(width, height)
+    writer = png.PNGStreamWriter(width, height)
+    row_size = width * png.BYTES_PER_PIXEL
+
+    output = BytesIO()
+    output.write(writer.header())
+    # feed rows in uneven batches to mimic tiles
+    output.write(writer.write_rows(raw[:3 * row_size]))
+    output.write(writer.write_rows(raw[3 * row_size:4 * row_size]))
+    output.write(writer.write_rows(raw[4 * row_size:]))
+    output.write(writer.finish())
+
+    image = Image.open(BytesIO(output.getvalue()))
+    assert image.size == (width, height)
+    assert image.mode == 'RGB'
+    assert image.tobytes() == raw
+
+
+def test_png_stream_writer_rejects_partial_rows():
+    writer = png.PNGStreamWriter(4, 2)
+    with pytest.raises(ValueError):
+        writer.write_rows(b'\x00' * 5)
+
+
+def test_png_stream_writer_rejects_early_finish():
+    writer = png.PNGStreamWriter(4, 2)
+    writer.write_rows(b'\x00' * 12)
+    with pytest.raises(ValueError):
+        writer.finish()
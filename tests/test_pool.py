@@ -0,0 +1,168 @@
+import asyncio
+
+import pytest
+
+from chromewhip.chrome import ConnectionLostError
+from chromewhip.pool import TabPool
+from chromewhip.watchdog import Watchdog
+
+
+class FakeTab:
+
+    def __init__(self, id_, heap_bytes=0):
+        self.id_ = id_
+        self.heap_bytes = heap_bytes
+        self.is_alive = True
+        self.ping_result = True
+        self.pings = 0
+
+    def fail(self, error):
+        self.is_alive = False
+
+    async def send_command(self, command):
+        assert command[0]['method'] == 'Runtime.getHeapUsage'
+        return {'ack': {'result': {'usedSize': self.heap_bytes, 'totalSize': self.heap_bytes}}}
+
+    async def ping(self, timeout):
+        self.pings += 1
+        if isinstance(self.ping_result, Exception):
+            raise self.ping_result
+        return self.ping_result
+
+
+class FakeChrome:
+
+    def __init__(self, num_tabs=1):
+        self._tabs = [FakeTab('tab-%s' % i) for i in range(num_tabs)]
+        self.closed = []
+        self.connects = 0
+
+    async def connect(self):
+        self.connects += 1
+
+    async def ping(self, timeout):
+        return True
+
+    @property
+    def tabs(self):
+        return tuple(self._tabs)
+
+    async def create_tab(self, incognito=False):
+        tab = FakeTab('tab-%s' % (len(self._tabs) + len(self.closed)))
+        tab.incognito = incognito
+        self._tabs.append(tab)
+        return tab
+
+    async def close_tab(self, tab):
+        self._tabs.remove(tab)
+        self.closed.append(tab)
+
+
+@pytest.mark.asyncio
+async def test_pool_opens_tabs_up_to_size_once(event_loop):
+    chrome = FakeChrome(num_tabs=1)
+    pool = TabPool(chrome, size=3)
+    await asyncio.gather(pool.start(), pool.start())
+    assert chrome.connects == 1
+    assert [t.id_ for t in chrome.tabs] == ['tab-0', 'tab-1', 'tab-2']
+
+
+@pytest.mark.asyncio
+async def test_pool_hands_each_tab_to_one_render(event_loop):
+    pool = TabPool(FakeChrome(num_tabs=2), size=2)
+    held = []
+    release = asyncio.Event()
+
+    async def render():
+        async with pool.tab() as tab:
+            assert tab not in held
+            held.append(tab)
+            await release.wait()
+            held.remove(tab)
+
+    renders = [asyncio.ensure_future(render()) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    assert pool.in_use == 2
+    assert pool.waiting == 1
+
+    release.set()
+    await asyncio.gather(*renders)
+    # tabs are released in the background
+    await asyncio.sleep(0)
+    assert pool.in_use == 0
+    assert pool.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_pool_recycles_tabs(event_loop):
+    chrome = FakeChrome(num_tabs=1)
+    pool = TabPool(chrome, size=1, max_renders=2, max_heap_bytes=1000)
+
+    seen = []
+    for _ in range(3):
+        async with pool.tab() as tab:
+            seen.append(tab.id_)
+        await asyncio.sleep(0.01)
+    # the replacement was opened in the background once the render limit was reached
+    assert seen == ['tab-0', 'tab-0', 'tab-1']
+    assert [t.id_ for t in chrome.closed] == ['tab-0']
+
+    async with pool.tab() as tab:
+        # a heap over the threshold also gets the tab replaced
+        tab.heap_bytes = 2000
+    await asyncio.sleep(0.01)
+    assert [t.id_ for t in chrome.tabs] == ['tab-2']
+    assert [t.id_ for t in chrome.closed] == ['tab-0', 'tab-1']
+
+
+@pytest.mark.asyncio
+async def test_pool_replaces_crashed_tabs(event_loop):
+    chrome = FakeChrome(num_tabs=2)
+    pool = TabPool(chrome, size=2)
+    await pool.start()
+    crashed = chrome.tabs[0]
+    crashed.fail(Exception('crashed'))
+
+    # the crashed tab is skipped rather than handed out, and replaced in the background
+    async with pool.tab() as tab:
+        assert tab.id_ == 'tab-1'
+    await asyncio.sleep(0.01)
+    assert chrome.closed == [crashed]
+    assert [t.id_ for t in pool.tabs] == ['tab-1', 'tab-2']
+
+
+@pytest.mark.asyncio
+async def test_watchdog_only_replaces_idle_tabs_that_time_out(event_loop):
+    chrome = FakeChrome(num_tabs=3)
+    pool = TabPool(chrome, size=3)
+    await pool.start()
+    busy, hung, lost = chrome.tabs
+    hung.ping_result = False
+    lost.ping_result = ConnectionLostError('closed')
+    watchdog = Watchdog({'tab-pool': pool, 'chrome-driver': chrome})
+
+    async with pool.tab() as tab:
+        assert tab is busy
+        await watchdog.check()
+    assert busy.pings == 0
+    assert busy.is_alive and lost.is_alive
+    assert not hung.is_alive
+    await asyncio.sleep(0.01)
+    assert chrome.closed == [hung]
+
+
+@pytest.mark.asyncio
+async def test_incognito_pool_hands_each_tab_to_a_single_render(event_loop):
+    chrome = FakeChrome(num_tabs=1)
+    pool = TabPool(chrome, size=1, incognito=True)
+
+    seen = []
+    for _ in range(2):
+        async with pool.tab() as tab:
+            assert tab.incognito
+            seen.append(tab.id_)
+    await asyncio.sleep(0.01)
+    # the tab Chrome started with is left alone
+    assert seen == ['tab-1', 'tab-2']
+    assert [t.id_ for t in chrome.closed] == ['tab-1', 'tab-2']
+    assert [t.id_ for t in pool.tabs] == ['tab-3']
@@ -0,0 +1,44 @@
+import os
+
+from chromewhip.profiles import ProfileRegistry
+
+PROFILES_DIR = os.path.join(os.path.dirname(__file__), 'resources/js/profiles')
+
+
+def _write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_registry_loads_every_subfolder_as_a_profile():
+    registry = ProfileRegistry(PROFILES_DIR)
+    assert registry.reload()
+    profile = registry.get('httpbin-org-html')
+    # files run in name order
+    assert profile.source.index('Chromewhip') < profile.source.index('All profiles ran!')
+
+    # a single profile folder still works as it did before
+    registry = ProfileRegistry(os.path.join(PROFILES_DIR, 'httpbin-org-html'))
+    registry.reload()
+    assert registry.get('httpbin-org-html').source == profile.source
+
+
+def test_registry_swaps_changed_profiles(tmpdir):
+    root = str(tmpdir)
+    _write(os.path.join(root, 'first', 'a.js'), 'first();')
+    _write(os.path.join(root, 'second', 'a.js'), 'second();')
+    registry = ProfileRegistry(root)
+    registry.reload()
+    first, second = registry.get('first'), registry.get('second')
+    assert not registry.reload()
+
+    _write(os.path.join(root, 'first', 'b.js'), 'again();')
+    _write(os.path.join(root, 'third', 'a.js'), 'third();')
+    assert registry.reload()
+
+    assert registry.get('first').source == 'first();\nagain();\n'
+    assert registry.get('third').source == 'third();\n'
+    # renders holding the old version are unaffected, and unchanged profiles are kept as is
+    assert first.source == 'first();\n'
+    assert registry.get('second') is second
@@ -0,0 +1,53 @@
+import asyncio
+import base64
+
+import pytest
+
+from chromewhip.protocol import page
+from chromewhip.screencast import Screencast
+
+
+class FakeTab:
+
+    def __init__(self):
+        self.acked = []
+
+    async def send_command(self, command):
+        if command[0]['method'] == 'Page.screencastFrameAck':
+            self.acked.append(command[0]['params']['sessionId'])
+
+    def add_event_listener(self, event_cls, callback):
+        pass
+
+    def remove_event_listener(self, event_cls, callback):
+        pass
+
+
+def _frame(session_id):
+    metadata = page.ScreencastFrameMetadata(offsetTop=0, pageScaleFactor=1, deviceWidth=800, deviceHeight=600,
+                                            scrollOffsetX=0, scrollOffsetY=0)
+    return page.ScreencastFrameEvent(base64.b64encode(b'frame %d' % session_id).decode(), metadata, session_id)
+
+
+@pytest.mark.asyncio
+async def test_screencast_acks_frames_as_they_are_read(event_loop):
+    tab = FakeTab()
+    cast = Screencast(800, 600, max_fps=30)
+    await cast.attach(tab)
+
+    # a viewer that falls behind only ever gets the latest frames
+    for session_id in range(1, 5):
+        cast.on_frame(_frame(session_id))
+    await asyncio.sleep(0)
+    assert tab.acked == [1, 2]
+
+    frames = cast.frames()
+    assert await frames.__anext__() == b'frame 3'
+    # acknowledged once read, so that Chrome sends the next frame
+    assert tab.acked == [1, 2]
+    assert await frames.__anext__() == b'frame 4'
+    assert tab.acked == [1, 2, 3]
+    await frames.aclose()
+
+    with pytest.raises(ValueError):
+        Screencast(800, 600, max_fps=60)
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+from chromewhip import chrome
+from chromewhip.protocol import runtime
+from chromewhip.transport import PipeConnection, TransportClosed, launch_with_pipe
+
+# answers a single command on fds 3 and 4 with the arguments it was started with, then waits for the pipe to close
+PIPE_CHROME = '''
+import json, os, sys
+data = b''
+while not data.endswith(b'\\0'):
+    data += os.read(3, 4096)
+message = json.loads(data[:-1])
+reply = {'id': message['id'], 'result': {'result': {'type': 'string', 'value': ' '.join(sys.argv[1:])}}}
+os.write(4, json.dumps(reply).encode() + b'\\0')
+while os.read(3, 4096):
+    pass
+'''
+
+
+async def fake_chrome(commands_read: int, messages_write: int):
+    """ Evaluates every expression to the id of the session it was sent over, like a browser of many tabs. """
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(commands_read, 'rb', 0))
+    while True:
+        message = json.loads((await reader.readuntil(b'\0'))[:-1])
+        reply = {'id': message['id'], 'sessionId': message['sessionId'],
+                 'result': {'result': {'type': 'string', 'value': message['sessionId']}}}
+        os.write(messages_write, json.dumps(reply).encode() + b'\0')
+
+
+@pytest.mark.asyncio
+async def test_pipe_multiplexes_sessions(event_loop):
+    commands_read, commands_write = os.pipe()
+    messages_read, messages_write = os.pipe()
+    connection = await PipeConnection.open(messages_read, commands_write)
+    browser = asyncio.ensure_future(fake_chrome(commands_read, messages_write))
+
+    async def attach(session_id):
+        return connection.session(session_id)
+
+    tabs = [chrome.ChromeTab('test', 'about:blank', None, id_, transport_factory=lambda id_=id_: attach(id_))
+            for id_ in ('a', 'b')]
+    for tab in tabs:
+        await tab.connect()
+
+    # both tabs send a command with the same id
+    results = await asyncio.gather(*[t.send_command(runtime.Runtime.evaluate('1')) for t in tabs])
+    assert [r['ack']['result']['result'].value for r in results] == ['a', 'b']
+
+    browser.cancel()
+    os.close(messages_write)
+    await asyncio.sleep(0.01)
+    with pytest.raises(chrome.ConnectionLostError):
+        await tabs[0].send_command(runtime.Runtime.evaluate('1'))
+
+    for tab in tabs:
+        await tab.disconnect()
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_closes_previous_session(event_loop):
+    commands_read, commands_write = os.pipe()
+    messages_read, messages_write = os.pipe()
+    connection = await PipeConnection.open(messages_read, commands_write)
+    browser = asyncio.ensure_future(fake_chrome(commands_read, messages_write))
+
+    session_ids = iter(['a', 'b'])
+
+    async def attach():
+        # every attach to a target starts a session of its own
+        return connection.session(next(session_ids))
+
+    tab = chrome.ChromeTab('test', 'about:blank', None, 'target', transport_factory=attach)
+    await tab.connect()
+    await tab.connect()
+    # the first session is no longer fed messages
+    assert list(connection._sessions) == ['b']
+    result = await tab.send_command(runtime.Runtime.evaluate('1'))
+    assert result['ack']['result']['result'].value == 'b'
+
+    await tab.disconnect()
+    browser.cancel()
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_launch_with_pipe_hands_chrome_fds_3_and_4(event_loop):
+    process, connection = await launch_with_pipe([sys.executable, '-c', PIPE_CHROME])
+
+    async def attach():
+        return connection.session()
+
+    tab = chrome.ChromeTab('browser', '', None, 'browser', transport_factory=attach)
+    await tab.connect()
+
+    result = await tab.send_command(runtime.Runtime.evaluate('1'))
+    assert result['ack']['result']['result'].value == '--remote-debugging-pipe'
+
+    await tab.disconnect()
+    await connection.close()
+    assert await process.wait() == 0
+
+
+@pytest.mark.asyncio
+async def test_pipe_closes_on_invalid_message(event_loop):
+    commands_read, commands_write = os.pipe()
+    messages_read, messages_write = os.pipe()
+    connection = await PipeConnection.open(messages_read, commands_write)
+    session = connection.session()
+
+    os.write(messages_write, b'{"id": 1, \0')
+    with pytest.raises(TransportClosed):
+        await session.recv()
+
+    for fd in (commands_read, messages_write):
+        os.close(fd)
+    await connection.close()
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from chromewhip import waiting
+from chromewhip.chrome import ProtocolError
+from chromewhip.protocol import emulation, network, page
+
+LOADER_ID = '1000.2'
+
+
+def _lifecycle(name, loader_id=LOADER_ID):
+    return page.LifecycleEventEvent(frameId='1000.1', loaderId=loader_id, name=name, timestamp=1.0)
+
+
+def test_waiter_rejects_unknown_option():
+    with pytest.raises(ValueError):
+        waiting.PageSettledWaiter('networkidle1')
+
+
+@pytest.mark.asyncio
+async def test_waiter_lifecycle_ignores_other_loaders(event_loop):
+    waiter = waiting.PageSettledWaiter('domcontentloaded')
+    waiter.on_event(_lifecycle('DOMContentLoaded', loader_id='previous'))
+    assert not await waiter.wait(LOADER_ID, timeout=0.05)
+
+    # events seen before the navigation is acknowledged still count
+    waiter = waiting.PageSettledWaiter('domcontentloaded')
+    waiter.on_event(_lifecycle('DOMContentLoaded'))
+    assert await waiter.wait(LOADER_ID, timeout=0.05)
+
+
+@pytest.mark.asyncio
+async def test_waiter_network_idle(event_loop, monkeypatch):
+    monkeypatch.setattr(waiting, 'NETWORK_IDLE_S', 0.05)
+    waiter = waiting.PageSettledWaiter('networkidle0')
+    waiter.on_event(network.LoadingFinishedEvent(requestId='1', timestamp=1.0, encodedDataLength=0))
+    waiter.on_event(_lifecycle('load'))
+
+    request = network.Request(url='http://example.com/poll', method='GET', headers={}, initialPriority='Low',
+                              referrerPolicy='no-referrer')
+    waiter.on_event(network.RequestWillBeSentEvent(requestId='2', loaderId=LOADER_ID, documentURL='',
+                                                   request=request, timestamp=1.0, wallTime=1.0,
+                                                   initiator={'type': 'script'}))
+    task = asyncio.ensure_future(waiter.wait(LOADER_ID, timeout=1))
+    await asyncio.sleep(0.1)
+    # a request is still in flight, so the page hasn't settled
+    assert not task.done()
+
+    waiter.on_event(network.LoadingFailedEvent(requestId='2', timestamp=1.0, type='XHR', errorText='net::ERR'))
+    assert await task
+
+
+class DomainTab:
+    """ Counts domain users, and fails to turn lifecycle events off. """
+
+    def __init__(self):
+        self.domain_users = {}
+
+    def add_event_listener(self, event_cls, callback):
+        pass
+
+    def remove_event_listener(self, event_cls, callback):
+        pass
+
+    async def send_command(self, command):
+        if command[0]['params'] == {'enabled': False}:
+            raise ProtocolError('Target closed')
+
+    async def enable(self, domain):
+        self.domain_users[domain] = self.domain_users.get(domain, 0) + 1
+
+    async def disable(self, domain):
+        self.domain_users[domain] -= 1
+
+
+@pytest.mark.asyncio
+async def test_waiter_detach_releases_network_on_error(event_loop):
+    tab = DomainTab()
+    waiter = waiting.PageSettledWaiter('networkidle0')
+    await waiter.attach(tab)
+    with pytest.raises(ProtocolError):
+        await waiter.detach(tab)
+    assert tab.domain_users == {'Network': 0}
+
+
+@pytest.mark.asyncio
+async def test_virtual_time_waiter(event_loop):
+    with pytest.raises(ValueError):
+        waiting.VirtualTimeWaiter(0)
+
+    waiter = waiting.VirtualTimeWaiter(5000)
+    assert not await waiter.wait(LOADER_ID, timeout=0.05)
+    waiter.on_event(emulation.VirtualTimeBudgetExpiredEvent())
+    assert await waiter.wait(LOADER_ID, timeout=0.05)